@@ -1,8 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.html import format_html
+from django.utils import timezone
 
 from .models import *
+from .cache import tokens
 
 
 admin.site.site_title = "Find Me"
@@ -51,6 +53,7 @@ class NewUserAdmin(UserAdmin):
     list_display = ['id', 'username', 'email', 'phone', 'expired']
 
     def expire_tokens(self, request, queryset):
+        tokens.invalidate(*queryset.values_list('token', flat=True))
         queryset.update(expired=True, fcm_token='')
     expire_tokens.short_description = 'Expire auth tokens'
 
@@ -244,3 +247,31 @@ class ConnectAdmin(InfoModelAdmin):
     search_fields = ['user1__user__username', 'user2__user__username', 'create_time', 'retain1_time', 'retain2_time', 'retain_time']
     date_hierarchy = 'create_time'
     actions = [expire_connect]
+
+@admin.register(TrainingJob)
+class TrainingJobAdmin(InfoModelAdmin):
+
+    def retry_jobs(self, request, queryset):
+        queryset.exclude(status=TrainingJob.RUNNING).update(status=TrainingJob.PENDING, attempts=0, error='')
+    retry_jobs.short_description = 'Retry jobs'
+
+    readonly_fields = ['id', 'profile', 'status', 'attempts', 'error', 'create_time', 'start_time', 'finish_time']
+    fields = list_display = readonly_fields
+    list_filter = ['status']
+    search_fields = ['profile__user__username']
+    date_hierarchy = 'create_time'
+    actions = [retry_jobs]
+
+@admin.register(Notification)
+class NotificationAdmin(InfoModelAdmin):
+
+    def retry_notifications(self, request, queryset):
+        queryset.filter(status=Notification.FAILED).update(status=Notification.PENDING, attempts=0, error='', next_attempt_time=timezone.now())
+    retry_notifications.short_description = 'Retry notifications'
+
+    readonly_fields = ['id', 'profile', 'notification', 'data', 'status', 'attempts', 'error', 'create_time', 'next_attempt_time', 'send_time']
+    fields = list_display = readonly_fields
+    list_filter = ['status']
+    search_fields = ['profile__user__username']
+    date_hierarchy = 'create_time'
+    actions = [retry_notifications]
@@ -0,0 +1,99 @@
+import threading
+import numpy as np
+
+from algo.parameters import NUM_FACETS
+
+NUM_TABLES = 16
+NUM_BITS = 8
+SEED = 0
+
+
+class LSHIndex:
+    # random hyperplane lsh over facet vectors: close profiles land in the same bucket in at least one table.
+    # a profile's keys are recomputed whenever it is saved (see Profile.lsh_keys), so building the index
+    # for a matching job only hashes the profiles whose stored keys are missing
+
+    def __init__(self, dim=NUM_FACETS, num_tables=NUM_TABLES, num_bits=NUM_BITS, seed=SEED):
+        rng = np.random.default_rng(seed)
+        self.lock = threading.RLock()
+        self.planes = rng.standard_normal((num_tables, num_bits, dim)).astype(np.float32)
+        self.powers = 1 << np.arange(num_bits, dtype=np.int64)
+        self.key_width = (num_bits + 3) // 4
+        self.built = False
+        self.clear()
+
+    def clear(self):
+        self.buckets = [{} for _ in range(len(self.planes))]
+        self.keys = {}
+        self.vectors = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def hash(self, vectors):
+        # facets live in [0, 1], center them so hyperplanes through the origin split the space evenly
+        centered = np.asarray(vectors, dtype=np.float32).reshape(-1, self.planes.shape[2]) - 0.5
+        bits = np.einsum('tbd,nd->ntb', self.planes, centered) > 0
+        return bits.astype(np.int64) @ self.powers
+
+    def encode(self, keys):
+        # one fixed width hex key per table, what Profile.lsh_keys stores
+        return ''.join(f"{key:0{self.key_width}x}" for key in np.asarray(keys).tolist())
+
+    def decode(self, texts):
+        if not texts:
+            return np.zeros((0, len(self.planes)), dtype=np.int64)
+        raw = np.frombuffer(''.join(texts).encode('ascii'), dtype=np.uint8).astype(np.int64)
+        digits = np.where(raw >= ord('a'), raw - ord('a') + 10, raw - ord('0')).reshape(len(texts), len(self.planes), self.key_width)
+        return digits @ (16 ** np.arange(self.key_width - 1, -1, -1, dtype=np.int64))
+
+    def build(self, ids, vectors, stored=None):
+        # stored maps ids to their encoded keys, the ones missing or of another table layout are hashed here.
+        # keys only hold for these planes, blank Profile.lsh_keys after changing SEED
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        stored = stored or {}
+        length = len(self.planes) * self.key_width
+        found = np.array([len(stored.get(id, '')) == length for id in ids.tolist()], dtype=bool)
+        keys = np.empty((len(ids), len(self.planes)), dtype=np.int64)
+        keys[found] = self.decode([stored[id] for id in ids[found].tolist()])
+        if not found.all():
+            keys[~found] = self.hash(vectors[~found])
+        with self.lock:
+            self.clear()
+            for id, row_keys, vector in zip(ids.tolist(), keys, vectors):
+                self.insert(id, row_keys, vector)
+            self.built = True
+
+    def insert(self, id, keys, vector):
+        keys = keys.tolist()
+        for table, key in enumerate(keys):
+            self.buckets[table].setdefault(key, set()).add(id)
+        self.keys[id] = keys
+        self.vectors[id] = vector
+
+    def probe(self, keys, flips):
+        ids = set()
+        for table, key in enumerate(keys.tolist()):
+            for flip in flips:
+                ids |= self.buckets[table].get(key ^ flip, set())
+        return ids
+
+    def query(self, vector, n):
+        with self.lock:
+            keys = self.hash(vector)[0]
+            ids = self.probe(keys, [0])
+            if len(ids) < n:
+                # multi-probe: also look into buckets one bit away
+                ids |= self.probe(keys, self.powers.tolist())
+            if not ids:
+                return np.zeros(0, dtype=np.int64)
+
+            ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+            if len(ids) <= n:
+                return np.sort(ids)
+            vectors = np.stack([self.vectors[id] for id in ids.tolist()])
+            distances = np.linalg.norm(vectors - np.asarray(vector, dtype=np.float32), axis=1)
+            return np.sort(ids[np.argpartition(distances, n - 1)[:n]])
+
+index = LSHIndex()
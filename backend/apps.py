@@ -8,18 +8,38 @@ class BackendConfig(AppConfig):
     def ready(self):
         from .signals import create_user_profile,\
                              delete_model,\
+                             update_lsh_keys,\
                              delete_zero_interest,\
+                             bump_user_render,\
+                             bump_profile_render,\
+                             bump_related_render,\
+                             bump_answer_render,\
                              UpdateAccessTime,\
                              UpdateConnectTime,\
                              on_connect_save,\
                              on_access_pre_save,\
                              on_access_save
+        from .lookups import trait_table
+        from .cache import bump_catalog
 
         post_save.connect(create_user_profile, sender='backend.User')
         post_delete.connect(delete_model, sender='backend.Profile')
+        pre_save.connect(update_lsh_keys, sender='backend.Profile')
         post_save.connect(delete_zero_interest, sender='backend.UserInterest')
         pre_save.connect(UpdateAccessTime.update_time, sender='backend.Access')
         pre_save.connect(UpdateConnectTime.update_time, sender='backend.Connect')
         post_save.connect(on_connect_save, sender='backend.Connect')
         pre_save.connect(on_access_pre_save, sender='backend.Access')
         post_save.connect(on_access_save, sender='backend.Access')
+        for model in ['backend.Personality', 'backend.Adjective']:
+            post_save.connect(trait_table.invalidate, sender=model)
+            post_delete.connect(trait_table.invalidate, sender=model)
+
+        post_save.connect(bump_user_render, sender='backend.User')
+        for signal in [post_save, post_delete]:
+            signal.connect(bump_profile_render, sender='backend.Profile')
+            for model in ['backend.UserInterest', 'backend.AvatarTimeline']:
+                signal.connect(bump_related_render, sender=model)
+            signal.connect(bump_answer_render, sender='backend.Answer')
+            for model in ['backend.Personality', 'backend.Adjective', 'backend.Interest', 'backend.Question', 'backend.AvatarBase', 'backend.Avatar', 'backend.Mood', 'backend.PersonalityQuestionnaire']:
+                signal.connect(bump_catalog, sender=model)
@@ -0,0 +1,124 @@
+import time
+import secrets
+import threading
+import contextlib
+from django.core.cache import cache, caches
+
+RENDER_TIMEOUT = 60 * 60 # in seconds
+TOKEN_TTL = 60 # in seconds
+MAX_TOKENS = 100000
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_TTL = 5 # in seconds
+VERSION_CACHE = 'versions'
+VERSION_CHUNK_SIZE = 500
+
+stats = {'hits': 0, 'misses': 0}
+stats_lock = threading.Lock()
+catalog = {'version': 0, 'expires': 0}
+local = threading.local()
+
+
+def versions():
+    return caches[VERSION_CACHE]
+
+def new_version():
+    # random instead of counted, so a bump is one plain set and concurrent bumps can not cancel each other out.
+    # 0 is what a never bumped key reads as
+    return secrets.randbits(63) or 1
+
+def bump_version(key):
+    versions().set(key, new_version(), timeout=None)
+
+def profile_version_key(profile_id):
+    return f"profile:{profile_id}:version"
+
+def bump_profile(profile_id):
+    bump_version(profile_version_key(profile_id))
+    if prefetched := getattr(local, 'versions', None):
+        prefetched.pop(profile_version_key(profile_id), None)
+
+def profile_version(profile_id):
+    key = profile_version_key(profile_id)
+    prefetched = getattr(local, 'versions', None)
+    if prefetched is not None and key in prefetched:
+        return prefetched[key]
+    return versions().get(key, 0)
+
+@contextlib.contextmanager
+def prefetched_versions(profile_ids):
+    # list views read every profile version they render, and the catalog version, in one round trip instead of one per row
+    keys = [profile_version_key(profile_id) for profile_id in profile_ids]
+    found = versions().get_many(keys[:VERSION_CHUNK_SIZE] + [CATALOG_VERSION_KEY])
+    for start in range(VERSION_CHUNK_SIZE, len(keys), VERSION_CHUNK_SIZE):
+        found.update(versions().get_many(keys[start:start + VERSION_CHUNK_SIZE]))
+    catalog['version'] = found.get(CATALOG_VERSION_KEY, 0)
+    catalog['expires'] = time.monotonic() + CATALOG_TTL
+    local.versions = {key: found.get(key, 0) for key in keys}
+    try:
+        yield
+    finally:
+        local.versions = None
+
+def catalog_version():
+    # re-read from the shared cache at most every CATALOG_TTL seconds, so catalog etags are answered without the db
+    if catalog['expires'] < time.monotonic():
+        catalog['version'] = versions().get(CATALOG_VERSION_KEY, 0)
+        catalog['expires'] = time.monotonic() + CATALOG_TTL
+    return catalog['version']
+
+def bump_catalog(*args, **kwargs):
+    bump_version(CATALOG_VERSION_KEY)
+    catalog['expires'] = 0
+
+def count(name):
+    with stats_lock:
+        stats[name] += 1
+
+def hit_rate():
+    total = stats['hits'] + stats['misses']
+    return stats['hits'] / total if total else 0.0
+
+def cached_render(profile, kind, render, *args):
+    # any change to the profile or to the shared catalog moves the key, so stale renders are never read again.
+    # renders stay in this process, only the versions are shared
+    key = f"render:{profile.id}:{profile_version(profile.id)}:{catalog_version()}:{kind}:{':'.join(map(str, args))}"
+    value = cache.get(key)
+    if value is None:
+        count('misses')
+        value = render(*args)
+        cache.set(key, value, timeout=RENDER_TIMEOUT)
+    else:
+        count('hits')
+    return value
+
+
+class TokenCache:
+    # auth token -> (user id, profile id, expired), local to this process
+
+    def __init__(self, ttl=TOKEN_TTL, max_size=MAX_TOKENS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, token):
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self.invalidate(token)
+            return None
+        return entry[0]
+
+    def set(self, token, user_id, profile_id, expired):
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                self.entries.clear()
+            self.entries[token] = ((user_id, profile_id, expired), time.monotonic() + self.ttl)
+
+    def invalidate(self, *tokens):
+        with self.lock:
+            for token in tokens:
+                self.entries.pop(token, None)
+
+tokens = TokenCache()
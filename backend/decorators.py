@@ -6,3 +6,10 @@ def auth_exempt(function):
         return function(*args, **kwargs)
     wrap.auth_exempt = True
     return wraps(function)(wrap)
+
+def catalog(function):
+
+    def wrap(*args, **kwargs):
+        return function(*args, **kwargs)
+    wrap.catalog = True
+    return wraps(function)(wrap)
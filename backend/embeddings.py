@@ -0,0 +1,104 @@
+import os
+import numpy as np
+
+from django.conf import settings
+
+EMBEDDING_SIZE = 16
+HIDDEN_UNITS = 64
+EPOCHS = 10
+BATCH_SIZE = 256
+BASE_MODEL_PATH = os.path.join(settings.ML_DIR, 'base.h5')
+EMBEDDINGS_PATH = os.path.join(settings.ML_DIR, 'embeddings.npz')
+
+
+def fit_width(features, width):
+    if features.shape[1] == width:
+        return features
+    if features.shape[1] > width:
+        return features[:, :width]
+    return np.pad(features, ((0, 0), (0, width - features.shape[1])))
+
+class EmbeddingTable:
+
+    def __init__(self, ids=(), vectors=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = np.asarray(vectors, dtype=np.float32) if vectors is not None else np.zeros((0, EMBEDDING_SIZE), dtype=np.float32)
+        self.rows = {id: row for row, id in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path=EMBEDDINGS_PATH):
+        try:
+            with np.load(path) as data:
+                return cls(data['ids'], data['vectors'])
+        except OSError:
+            return cls()
+
+    def save(self, path=EMBEDDINGS_PATH):
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path, ids=self.ids, vectors=self.vectors)
+        os.replace(temp_path, path)
+
+    def get(self, id):
+        if id in self.rows:
+            return self.vectors[self.rows[id]]
+        # users without feedback yet start from the average user
+        if len(self.ids):
+            return self.vectors.mean(axis=0)
+        return np.zeros(EMBEDDING_SIZE, dtype=np.float32)
+
+    def keep(self, ids):
+        keep = np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        self.__init__(self.ids[keep], self.vectors[keep])
+
+class SharedModel:
+    # same predict interface as a per-user keras model, so matching.score works with either
+
+    def __init__(self, base, embedding):
+        self.base = base
+        self.embedding = np.asarray(embedding, dtype=np.float32)
+
+    def predict(self, features, batch_size=None):
+        features = fit_width(features, self.base.inputs[0].shape[-1])
+        embeddings = np.broadcast_to(self.embedding, (len(features), len(self.embedding)))
+        return self.base.predict([features, embeddings], batch_size=batch_size)
+
+def create_base_model(num_features):
+    from tensorflow import keras
+
+    features = keras.Input(shape=(num_features, ), name='features')
+    embedding = keras.Input(shape=(EMBEDDING_SIZE, ), name='embedding')
+    hidden = keras.layers.Concatenate()([features, embedding])
+    hidden = keras.layers.Dense(HIDDEN_UNITS, activation='relu')(hidden)
+    score = keras.layers.Dense(1, activation='sigmoid')(hidden)
+    return keras.Model([features, embedding], score, name='base')
+
+def load_base_model(path=BASE_MODEL_PATH):
+    from tensorflow import keras
+
+    if not os.path.exists(path):
+        raise OSError(f"No shared model at {path}")
+    return keras.models.load_model(path)
+
+def load_model(profile_id):
+    return SharedModel(load_base_model(), EmbeddingTable.load().get(profile_id))
+
+def train_shared(candidates, me_ids, other_ids, labels, epochs=EPOCHS):
+    from tensorflow import keras
+
+    user_ids = np.unique(me_ids)
+    user_rows = np.searchsorted(user_ids, me_ids)
+    other_rows = np.array([candidates.rows[id] for id in other_ids], dtype=np.int64)
+
+    base = create_base_model(candidates.features.shape[1])
+    user = keras.Input(shape=(1, ), dtype='int32', name='user')
+    features = keras.Input(shape=(candidates.features.shape[1], ), name='features')
+    embedding_layer = keras.layers.Embedding(len(user_ids), EMBEDDING_SIZE, name='user_embedding')
+    embedding = keras.layers.Flatten()(embedding_layer(user))
+    model = keras.Model([user, features], base([features, embedding]))
+    model.compile(optimizer='adam', loss='binary_crossentropy')
+    model.fit([user_rows, candidates.features[other_rows]], np.asarray(labels, dtype=np.float32), epochs=epochs, batch_size=BATCH_SIZE, verbose=0)
+
+    return base, EmbeddingTable(user_ids, embedding_layer.get_weights()[0])
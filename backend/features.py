@@ -0,0 +1,36 @@
+import numpy as np
+
+from .models import FLOAT_PRECISION, Profile, Interest, UserInterest
+
+from algo.parameters import NUM_FACETS
+
+
+def decode_facets(personalities):
+    if not personalities:
+        return np.zeros((0, NUM_FACETS), dtype=np.float32)
+    raw = np.frombuffer(''.join(personalities).encode('ascii'), dtype=np.uint8)
+    digits = (raw - ord('0')).reshape(-1, NUM_FACETS, FLOAT_PRECISION).astype(np.float32)
+    scale = (10.0 ** -np.arange(1, FLOAT_PRECISION + 1)).astype(np.float32)
+    return digits @ scale
+
+def normalize_rows(matrix):
+    lengths = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, lengths, out=np.zeros_like(matrix), where=lengths > 0)
+
+
+def load_features():
+    # every profile's facets and normalized interests as one float32 matrix, read once per matching job.
+    # nothing keeps it current afterwards, a job sees the db as it was when it loaded
+    ids, personalities = [], []
+    for id, personality in Profile.objects.order_by('pk').values_list('pk', '_personality'):
+        ids.append(id)
+        personalities.append(personality)
+
+    rows = {id: row for row, id in enumerate(ids)}
+    last_interest = Interest.objects.order_by('pk').values_list('pk', flat=True).last() or 0
+    amounts = np.zeros((len(ids), last_interest), dtype=np.float32)
+    for user_id, interest_id, amount in UserInterest.objects.values_list('user_id', 'interest_id', 'amount'):
+        if user_id in rows:
+            amounts[rows[user_id], interest_id - 1] = amount
+
+    return np.asarray(ids, dtype=np.int64), np.hstack([decode_facets(personalities), normalize_rows(amounts)])
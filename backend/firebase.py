@@ -1,81 +1,354 @@
+import os
+import time
+import uuid
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from django.conf import settings
-from firebase_admin import credentials, firestore, initialize_app, db, messaging
+from django.utils import timezone
 
 from .models import Connect
 
-cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
-initialize_app(cred, {'databaseURL': 'https://findmetoo-c20a2-default-rtdb.firebaseio.com/'})
+FANOUT_WORKERS = 16
+FANOUT_DEADLINE = 2 # in seconds
+UNREAD_CACHE_TTL = 60 # in seconds
+UNREAD_CACHE_SIZE = 10000
+MESSAGING_BATCH_SIZE = 500 # fcm limit
+LOCAL_SENT_SIZE = 10000
+TOKEN, MESSAGE, RETRY = 'token', 'message', 'retry'
 
+app = None
+app_lock = threading.RLock()
+clients = {}
+backends = {}
+executor = None
+unread_cache = {}
+calls = {}
+calls_lock = threading.Lock()
+
+def reset_after_fork():
+    # grpc channels, locks and pool threads of the parent are not usable in a forked worker, it builds its own on first use
+    global app, app_lock, executor, calls_lock
+    app = None
+    app_lock = threading.RLock()
+    clients.clear()
+    backends.clear()
+    executor = None
+    calls.clear()
+    calls_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+def get_app():
+    # firebase_admin is only imported and initialized on first use, not at server start
+    global app
+    if app is None:
+        with app_lock:
+            if app is None:
+                from firebase_admin import credentials, initialize_app
+
+                cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
+                # named per process, firebase_admin keeps every client it hands out on the app
+                app = initialize_app(cred, {'databaseURL': settings.FIREBASE_DATABASE_URL}, name=f"backend-{os.getpid()}")
+    return app
+
+def get_client(name, factory):
+    client = clients.get(name)
+    if client is None:
+        with app_lock:
+            client = clients.get(name)
+            if client is None:
+                client = clients[name] = factory(get_app())
+    return client
+
+def get_firestore():
+    from firebase_admin import firestore
+    return get_client('firestore', firestore.client)
+
+def get_rtdb():
+    from firebase_admin import db
+    return get_client('rtdb', lambda app: db.reference(app=app))
+
+def instrumented(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with calls_lock:
+                entry = calls.setdefault(function.__name__, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                entry['calls'] += 1
+                entry['errors'] += failed
+                entry['total_ms'] += elapsed
+                entry['max_ms'] = max(entry['max_ms'], elapsed)
+    return wrapper
+
+def call_stats():
+    with calls_lock:
+        return {
+            name: {**entry, 'total_ms': round(entry['total_ms'], 3), 'max_ms': round(entry['max_ms'], 3), 'mean_ms': round(entry['total_ms'] / entry['calls'], 3)}
+            for name, entry in calls.items()
+        }
+
+
+class FirebaseBackend:
+    # firestore for chats, realtime database for presence, fcm for messaging
+
+    def create_chat(self, connect_id):
+        doc_ref = get_firestore().collection('chats').document()
+        doc_ref.set({'connectId': connect_id})
+        return doc_ref.id
+
+    def get_last_message(self, chat_id):
+        from firebase_admin import firestore
+
+        messages = get_firestore().collection('chats')\
+                 .document(chat_id)\
+                 .collection('chats')\
+                 .order_by('timestamp', direction=firestore.Query.DESCENDING)\
+                 .limit(1).get()
+
+        if not messages:
+            return None
+
+        message = messages[0]
+        return {"id": message.id, **message.to_dict()}
+
+    def count_unread(self, chat_id, user, after):
+        query = get_firestore().collection('chats')\
+              .document(chat_id)\
+              .collection('chats')\
+              .where('user', '==', user)\
+              .where('timestamp', '>', after)
+
+        if hasattr(query, 'count'):
+            # server side aggregation, nothing but the number comes back
+            return query.count().get()[0][0].value
+        # older clients: only document names are sent, not the messages
+        return sum(1 for _ in query.select([]).stream())
+
+    def get_state(self, key):
+        return get_rtdb().child(key).get()
+
+    def set_state(self, key, state):
+        get_rtdb().child(key).set(state)
+
+    def build_message(self, token, notification_dict, data):
+        from firebase_admin import messaging
+
+        notification = messaging.Notification(**notification_dict) if notification_dict else None
+
+        icon = f'http://{settings.HOST}{settings.MEDIA_URL}icon.png'
+
+        android_notification = messaging.AndroidNotification(**notification_dict, click_action='FLUTTER_NOTIFICATION_CLICK', icon=icon, priority='high') if notification_dict else None
+        android = messaging.AndroidConfig(notification=android_notification, data=data)
+
+        return messaging.Message(notification=notification, android=android, data=data, token=token)
+
+    def failure_kind(self, error):
+        from firebase_admin import messaging, exceptions
+
+        # TOKEN and MESSAGE failures can not succeed when sent again
+        if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+            return TOKEN
+        if isinstance(error, exceptions.InvalidArgumentError):
+            return MESSAGE
+        return RETRY
+
+    def send(self, messages):
+        from firebase_admin import messaging
+
+        send = getattr(messaging, 'send_each', None) or messaging.send_all
+        response = send(messages, app=get_app())
+        return [None if item.success else (str(item.exception), self.failure_kind(item.exception)) for item in response.responses]
+
+class LocalBackend:
+    # in-memory stand-in of this process, every call is delayed by FIREBASE_LATENCY
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chats = {}
+        self.states = {}
+        self.sent = deque(maxlen=LOCAL_SENT_SIZE)
+        self.invalid_tokens = set()
+
+    def delay(self):
+        if settings.FIREBASE_LATENCY:
+            time.sleep(settings.FIREBASE_LATENCY)
+
+    def create_chat(self, connect_id):
+        self.delay()
+        chat_id = uuid.uuid4().hex[:20]
+        with self.lock:
+            self.chats[chat_id] = []
+        return chat_id
+
+    def add_message(self, chat_id, user, message, timestamp=None):
+        # what the app clients write to firestore directly
+        self.delay()
+        with self.lock:
+            messages = self.chats.setdefault(chat_id, [])
+            messages.append({"id": uuid.uuid4().hex[:20], "user": user, "message": message, "timestamp": timestamp or timezone.now()})
+
+    def get_last_message(self, chat_id):
+        self.delay()
+        with self.lock:
+            messages = self.chats.get(chat_id)
+            return dict(max(messages, key=lambda message: message['timestamp'])) if messages else None
+
+    def count_unread(self, chat_id, user, after):
+        self.delay()
+        with self.lock:
+            return sum(1 for message in self.chats.get(chat_id, []) if message['user'] == user and message['timestamp'] > after)
+
+    def get_state(self, key):
+        self.delay()
+        with self.lock:
+            state = self.states.get(key)
+            return dict(state) if state is not None else None
+
+    def set_state(self, key, state):
+        self.delay()
+        with self.lock:
+            self.states[key] = dict(state)
+
+    def build_message(self, token, notification_dict, data):
+        return {"token": token, "notification": notification_dict, "data": data}
+
+    def send(self, messages):
+        self.delay()
+        results = []
+        with self.lock:
+            for message in messages:
+                if message['token'] in self.invalid_tokens:
+                    results.append(('Requested entity was not found.', TOKEN))
+                else:
+                    self.sent.append(message)
+                    results.append(None)
+        return results
+
+BACKENDS = {
+    'firebase': FirebaseBackend,
+    'local': LocalBackend,
+}
+
+def get_backend():
+    name = settings.FIREBASE_BACKEND
+    backend = backends.get(name)
+    if backend is None:
+        with app_lock:
+            backend = backends.get(name)
+            if backend is None:
+                backend = backends[name] = BACKENDS[name]()
+    return backend
+
+@instrumented
 def create_new_chat(connect_id):
-    db = firestore.client()
-    doc_ref = db.collection('chats').document()
-    doc_ref.set({'connectId': connect_id})
-    return doc_ref.id
+    return get_backend().create_chat(connect_id)
 
+@instrumented
 def get_last_message(chat_id):
-    db = firestore.client()
-    messages = db.collection('chats')\
-             .document(chat_id)\
-             .collection('chats')\
-             .order_by('timestamp', direction=firestore.Query.DESCENDING)\
-             .limit(1).get()
+    return get_backend().get_last_message(chat_id)
+
+@instrumented
+def get_unread_num(chat_id, me, last_read_time):
+    key = (settings.FIREBASE_BACKEND, chat_id, me, last_read_time)
+    if (cached := unread_cache.get(key)) and cached[1] > time.monotonic():
+        return cached[0]
 
-    if not messages:
-        return None
+    count = get_backend().count_unread(chat_id, 3 - me, last_read_time)
 
-    message = messages[0]
-    return {"id": message.id, **message.to_dict()}
+    if len(unread_cache) >= UNREAD_CACHE_SIZE:
+        unread_cache.clear()
+    unread_cache[key] = (count, time.monotonic() + UNREAD_CACHE_TTL)
+    return count
 
-def get_unread_num(chat_id, me, last_read_time):
-    db = firestore.client()
-    messages = db.collection('chats')\
-          .document(chat_id)\
-          .collection('chats')\
-          .where('user', '==', 3 - me)\
-          .where('timestamp', '>', last_read_time)\
-          .get()
-    return len(messages)
+def get_executor():
+    global executor
+    if executor is None:
+        with app_lock:
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='firebase')
+    return executor
+
+def fan_out(calls, deadline=FANOUT_DEADLINE, missing=None):
+    # calls are (function, *args), run concurrently. Anything failed or not back by the deadline is `missing`.
+    pool = get_executor()
+    futures = [pool.submit(*call) for call in calls]
+    wait(futures, timeout=deadline)
+
+    def result(future):
+        if future.done() and not future.cancelled() and future.exception() is None:
+            return future.result()
+        future.cancel()
+        return missing
+
+    return [result(future) for future in futures]
+
+def get_chat_summaries(chats, deadline=FANOUT_DEADLINE):
+    # chats are (chat_id, me, last_read_time)
+    results = fan_out([call for chat_id, me, last_read_time in chats for call in [(get_last_message, chat_id), (get_unread_num, chat_id, me, last_read_time)]], deadline)
+    return list(zip(results[::2], results[1::2]))
 
+@instrumented
 def get_connect_state(connect_id, user):
+    backend = get_backend()
     refs = Connect.objects.filter(active=True).filter(user1=user)
     for ref in refs:
         if ref.id != connect_id:
-            return db.reference().child(f'{ref.id}-1').get()
+            return backend.get_state(f'{ref.id}-1')
     refs = Connect.objects.filter(active=True).filter(user2=user)
     for ref in refs:
         if ref.id != connect_id:
-            return db.reference().child(f'{ref.id}-2').get()
+            return backend.get_state(f'{ref.id}-2')
     return {
         'online': False,
         'lastSeen': round(user.last_questionnaire_time.timestamp() * 1000) if user.last_questionnaire_time is not None else 0,
         'typing': False
     }
 
+@instrumented
 def create_connect_state(connect):
+    backend = get_backend()
     state = get_connect_state(connect.id, connect.user1)
-    db.reference().child(f'{connect.id}-1').set({
+    backend.set_state(f'{connect.id}-1', {
         'online': state['online'],
         'lastSeen': state['lastSeen'],
         'typing': False,
     })
 
     state = get_connect_state(connect.id, connect.user2)
-    db.reference().child(f'{connect.id}-2').set({
+    backend.set_state(f'{connect.id}-2', {
         'online': state['online'],
         'lastSeen': state['lastSeen'],
         'typing': False,
     })
 
-def send_notification(profile, notification_dict, **data):
-    try:
-        notification = messaging.Notification(**notification_dict) if notification_dict else None
+def build_message(token, notification_dict, data):
+    return get_backend().build_message(token, notification_dict, data)
 
-        icon = f'http://{settings.HOST}{settings.MEDIA_URL}icon.png'
+@instrumented
+def send_messages(messages):
+    # one request per MESSAGING_BATCH_SIZE messages. Per message None when sent, else (error, failure kind)
+    backend = get_backend()
+    results = []
+    for start in range(0, len(messages), MESSAGING_BATCH_SIZE):
+        batch = messages[start:start + MESSAGING_BATCH_SIZE]
+        try:
+            results += backend.send(batch)
+        except ValueError:
+            # a malformed message fails its whole batch while encoding, nothing was sent yet, so find it one at a time
+            results += [send_one(backend, message) for message in batch]
+    return results
 
-        android_notification = messaging.AndroidNotification(**notification_dict, click_action='FLUTTER_NOTIFICATION_CLICK', icon=icon, priority='high') if notification_dict else None
-        android = messaging.AndroidConfig(notification=android_notification, data=data)
-
-        message = messaging.Message(notification=notification, android=android, data=data, token=profile.user.fcm_token)
-        messaging.send(message)
-    except:
-        pass
+def send_one(backend, message):
+    try:
+        return backend.send([message])[0]
+    except ValueError as e:
+        return (str(e), MESSAGE)
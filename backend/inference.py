@@ -0,0 +1,93 @@
+import os
+import numpy as np
+
+from django.conf import settings
+
+PARITY_TOLERANCE = 2e-2
+
+
+def softmax(x):
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+    'softmax': softmax,
+}
+
+def model_path(profile_id, extension='h5'):
+    return os.path.join(settings.ML_DIR, f"user{profile_id}.{extension}")
+
+def quantize(weights):
+    # symmetric int8 per output unit
+    scale = np.abs(weights).max(axis=0) / 127
+    scale[scale == 0] = 1
+    return np.round(weights / scale).astype(np.int8), scale.astype(np.float32)
+
+def export_model(model, path, quantized=True):
+    arrays = {}
+    layers = []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ('InputLayer', 'Dropout', 'Flatten'):
+            continue
+        if kind == 'Activation':
+            layers.append(layer.get_config()['activation'])
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Layer {layer.name} of type {kind} can not be exported.")
+
+        weights, bias = layer.get_weights()
+        n = len(layers)
+        if quantized:
+            arrays[f"w{n}"], arrays[f"s{n}"] = quantize(weights)
+        else:
+            arrays[f"w{n}"] = weights.astype(np.float32)
+        arrays[f"b{n}"] = bias.astype(np.float32)
+        layers.append(f"dense:{layer.get_config()['activation']}")
+
+    np.savez_compressed(path, layers=np.array(layers), **arrays)
+
+class NumpyModel:
+    # keras-free forward pass of an exported Dense stack, with the same predict interface
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    @classmethod
+    def load(cls, path):
+        layers = []
+        with np.load(path) as data:
+            for n, layer in enumerate(data['layers'].tolist()):
+                if not layer.startswith('dense:'):
+                    layers.append((None, None, ACTIVATIONS[layer]))
+                    continue
+                weights = data[f"w{n}"].astype(np.float32)
+                if f"s{n}" in data:
+                    weights *= data[f"s{n}"]
+                layers.append((weights, data[f"b{n}"], ACTIVATIONS[layer.split(':', 1)[1]]))
+        return cls(layers)
+
+    def predict(self, features, batch_size=None):
+        outputs = np.asarray(features, dtype=np.float32)
+        for weights, bias, activation in self.layers:
+            if weights is not None:
+                outputs = outputs @ weights + bias
+            outputs = activation(outputs)
+        return outputs
+
+def parity(keras_model, numpy_model, features):
+    expected = np.asarray(keras_model.predict(features), dtype=np.float32).reshape(-1)
+    actual = numpy_model.predict(features).reshape(-1)
+    return float(np.abs(expected - actual).max()) if len(expected) else 0.0
+
+def load_model(profile_id):
+    numpy_path = model_path(profile_id, 'npz')
+    if settings.ML_INFERENCE == 'numpy' and os.path.exists(numpy_path):
+        return NumpyModel.load(numpy_path)
+
+    from algo.match import create_model
+    return create_model(model_path(profile_id))
@@ -0,0 +1,49 @@
+import time
+import threading
+from collections import defaultdict
+
+from .models import Personality, Adjective
+
+TABLE_TTL = 60 * 5 # in seconds
+
+
+class TraitTable:
+    # Personality and Adjective rows keyed the way Profile.traits reads them, rebuilt when either model changes.
+    # Signals only reach this process, the ttl bounds how stale other workers can get.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        self.load_time = 0
+
+    def load(self):
+        personalities = list(Personality.objects.order_by('trait'))
+        adjectives = defaultdict(list)
+        for adjective in Adjective.objects.order_by('pk'):
+            adjectives[(adjective.trait, adjective.facet, adjective.pool)].append({"name": adjective.name, "description": adjective.description})
+
+        return {
+            "names": [personality.display_name for personality in personalities],
+            "traits": {personality.trait: {
+                "display_name": personality.display_name,
+                "description": personality.description,
+                "url": personality.get_urls(),
+                "position": position,
+            } for position, personality in enumerate(personalities)},
+            "adjectives": dict(adjectives),
+        }
+
+    def get(self):
+        data = self.data
+        if data is None or time.monotonic() - self.load_time > TABLE_TTL:
+            with self.lock:
+                if self.data is None or time.monotonic() - self.load_time > TABLE_TTL:
+                    self.data = self.load()
+                    self.load_time = time.monotonic()
+                data = self.data
+        return data
+
+    def invalidate(self, *args, **kwargs):
+        self.data = None
+
+trait_table = TraitTable()
@@ -1,7 +1,4 @@
 import pickle
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
@@ -11,6 +8,9 @@ SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
 class GoogleCommand(BaseCommand):
 
     def get_data(self, spreadsheet_id, spreadsheet_name):
+        from googleapiclient.discovery import build
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
 
         creds = None
         try:
@@ -0,0 +1,308 @@
+import os
+import io
+import json
+import time
+import resource
+import datetime
+import tempfile
+import contextlib
+import numpy as np
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from backend.models import FLOAT_PRECISION, User, Profile, Interest, UserInterest, Access, Connect, Notification
+from backend.ann import LSHIndex, index
+from backend.matching import SHORTLIST_SIZE, Candidates, match, exclusions, top_k
+from backend.management.commands.refresh import TIME_TO_REFRESH
+from backend.notifications import deliver
+from backend import views, firebase
+
+from algo.parameters import NUM_FACETS
+
+POPULATIONS = [1000, 10000, 100000]
+NUM_QUERIES = 100
+TOP_K = 5
+NUM_INTERESTS = 20
+INTERESTS_PER_USER = 5
+ACCESSES_PER_USER = 5
+REFRESH_USERS = 50
+MODEL_REPEATS = 3
+BULK_BATCH_SIZE = 1000
+MIN_SHORTLIST_RECALL = 0.95
+FIREBASE_LATENCIES = [0, 0.01, 0.05] # in seconds
+MESSAGES_PER_CHAT = 3
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1000
+    return {"p50_ms": round(float(np.percentile(timings, 50)), 3), "p95_ms": round(float(np.percentile(timings, 95)), 3)}
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(usage / 1024, 1)
+
+class Rollback(Exception):
+    pass
+
+@contextlib.contextmanager
+def synthetic_population(size, rng):
+    # everything is written inside one transaction that is rolled back afterwards
+    try:
+        with transaction.atomic():
+            rows = {}
+
+            interest_ids = list(Interest.objects.values_list('pk', flat=True))
+            if not interest_ids:
+                Interest.objects.bulk_create([Interest(name=f"bench{i}") for i in range(NUM_INTERESTS)])
+                interest_ids = list(Interest.objects.values_list('pk', flat=True))
+                rows['interests'] = len(interest_ids)
+
+            prefix = f"bench{rng.integers(1 << 30)}_"
+            User.objects.bulk_create([User(username=f"{prefix}{i}", email=f"{prefix}{i}@bench.local", phone=str(9000000000 + i), fcm_token=f"{prefix}{i}", password='!') for i in range(size)], batch_size=BULK_BATCH_SIZE)
+            user_ids = list(User.objects.filter(username__startswith=prefix).values_list('pk', flat=True))
+            rows['users'] = len(user_ids)
+
+            digits = rng.integers(0, 10, (size, NUM_FACETS * FLOAT_PRECISION)).astype(np.uint8) + ord('0')
+            Profile.objects.bulk_create([Profile(user_id=user_id, _personality=row.tobytes().decode('ascii')) for user_id, row in zip(user_ids, digits)], batch_size=BULK_BATCH_SIZE)
+            profile_ids = np.array(Profile.objects.filter(user__username__startswith=prefix).values_list('pk', flat=True), dtype=np.int64)
+            rows['profiles'] = len(profile_ids)
+
+            UserInterest.objects.bulk_create([
+                UserInterest(user_id=profile_id, interest_id=interest_id, amount=int(rng.integers(1, 4)))
+                for profile_id in profile_ids.tolist()
+                for interest_id in rng.choice(interest_ids, min(INTERESTS_PER_USER, len(interest_ids)), replace=False).tolist()
+            ], batch_size=BULK_BATCH_SIZE)
+            rows['user_interests'] = UserInterest.objects.filter(user__user__username__startswith=prefix).count()
+
+            accesses = [
+                Access(me_id=me_id, other_id=other_id)
+                for me_id in profile_ids.tolist()
+                for other_id in rng.choice(profile_ids, ACCESSES_PER_USER, replace=False).tolist() if other_id != me_id
+            ]
+            Access.objects.bulk_create(accesses, batch_size=BULK_BATCH_SIZE)
+            rows['accesses'] = len(accesses)
+
+            # only a sample of users is due for refresh, the rest keep fresh accesses
+            refresh_ids = rng.choice(profile_ids, min(REFRESH_USERS, size), replace=False).tolist()
+            Access.objects.filter(me_id__in=refresh_ids).update(create_time=timezone.now() - TIME_TO_REFRESH - datetime.timedelta(hours=1))
+
+            index.built = False
+            yield profile_ids, refresh_ids, rows
+            raise Rollback
+    except Rollback:
+        pass
+    finally:
+        index.built = False
+
+
+class Command(BaseCommand):
+
+    help = "Benchmarks matching on synthetic populations and prints the results as json"
+
+    suites = ['ann', 'shortlist', 'matching', 'auth', 'firebase']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', help='benchmark suite to run', choices=self.suites, default='matching')
+        parser.add_argument('--sizes', help='population sizes to run with', type=int, nargs='+', default=POPULATIONS)
+        parser.add_argument('--queries', help='number of queries per population', type=int, default=NUM_QUERIES)
+        parser.add_argument('--seed', help='random seed', type=int, default=0)
+        parser.add_argument('--output', help='file to write json results to, stdout if not given')
+
+    def handle(self, *args, **kwargs):
+        rng = np.random.default_rng(kwargs['seed'])
+        runs = [getattr(self, f"bench_{kwargs['suite']}")(size, kwargs['queries'], rng) for size in kwargs['sizes']]
+        results = json.dumps({"suite": kwargs['suite'], "seed": kwargs['seed'], "runs": runs}, indent=2)
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as f:
+                f.write(results)
+        else:
+            self.stdout.write(results)
+
+    def bench_ann(self, size, queries, rng):
+        # no model here: negative euclidean distance stands in for the scores, so the recall is of nearest facets, not of model top matches
+        ids = np.arange(1, size + 1, dtype=np.int64)
+        facets = rng.random((size, NUM_FACETS), dtype=np.float32)
+
+        lsh = LSHIndex()
+        build_time, _ = timed(lsh.build, ids, facets)
+
+        exhaustive_timings, ann_timings, recalls, shortlist_sizes = [], [], [], []
+        for row in rng.choice(size, min(queries, size), replace=False):
+            query = facets[row]
+
+            start = time.perf_counter()
+            expected = ids[top_k(-np.linalg.norm(facets - query, axis=1), TOP_K)]
+            exhaustive_timings.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            shortlist = lsh.query(query, SHORTLIST_SIZE)
+            rows = shortlist - 1
+            found = shortlist[top_k(-np.linalg.norm(facets[rows] - query, axis=1), TOP_K)]
+            ann_timings.append(time.perf_counter() - start)
+
+            recalls.append(len(np.intersect1d(expected, found)) / len(expected))
+            shortlist_sizes.append(len(shortlist))
+
+        return {
+            "population": size,
+            "build_s": round(build_time, 3),
+            "exhaustive": percentiles(exhaustive_timings),
+            "ann": percentiles(ann_timings),
+            f"euclidean_recall_at_{TOP_K}": round(float(np.mean(recalls)), 4),
+            "mean_shortlist": round(float(np.mean(shortlist_sizes)), 1),
+        }
+
+    def train_model(self, model_path, repeats=1):
+        from algo.match import create_model, train_model
+
+        create_timings, train_timings = [], []
+        for _ in range(repeats):
+            create_time, model = timed(create_model)
+            train_time, _ = timed(train_model, model, filepath=model_path)
+            create_timings.append(create_time)
+            train_timings.append(train_time)
+        return create_model(model_path), create_timings, train_timings
+
+    def bench_shortlist(self, size, queries, rng):
+        # the real model's top matches when scoring everyone against scoring only the lsh shortlist
+        with tempfile.TemporaryDirectory() as ml_dir:
+            model, _, _ = self.train_model(os.path.join(ml_dir, 'bench.h5'))
+
+            with synthetic_population(size, rng) as (profile_ids, _, rows):
+                candidates = Candidates.load()
+                exhaustive_timings, shortlist_timings, recalls = [], [], []
+                for profile_id in rng.choice(profile_ids, min(queries, size), replace=False).tolist():
+                    exclude = exclusions([profile_id])[profile_id]
+                    exhaustive_time, expected = timed(match, model, candidates, TOP_K, profile_id=profile_id, exclude=exclude, shortlisted=False)
+                    shortlist_time, found = timed(match, model, candidates, TOP_K, profile_id=profile_id, exclude=exclude, shortlisted=True)
+                    exhaustive_timings.append(exhaustive_time)
+                    shortlist_timings.append(shortlist_time)
+                    if expected:
+                        recalls.append(len(set(expected) & set(found)) / len(expected))
+
+        recall = float(np.mean(recalls)) if recalls else 0.0
+        return {
+            "population": size,
+            "shortlist_size": SHORTLIST_SIZE,
+            "exhaustive": percentiles(exhaustive_timings),
+            "shortlist": percentiles(shortlist_timings),
+            f"model_recall_at_{TOP_K}": round(recall, 4),
+            "min_recall": MIN_SHORTLIST_RECALL,
+            # MATCH_EXHAUSTIVE_LIMIT may only be set below populations that pass
+            "gate_passed": recall >= MIN_SHORTLIST_RECALL,
+        }
+
+    def bench_matching(self, size, queries, rng):
+        with tempfile.TemporaryDirectory() as ml_dir, override_settings(ML_DIR=ml_dir, ML_MODE='user'):
+            model_path = os.path.join(ml_dir, 'bench.h5')
+            model, create_timings, train_timings = self.train_model(model_path, MODEL_REPEATS)
+
+            with synthetic_population(size, rng) as (profile_ids, refresh_ids, rows):
+                load_time, candidates = timed(Candidates.load)
+
+                match_timings = []
+                for profile_id in rng.choice(profile_ids, min(queries, size), replace=False).tolist():
+                    exclude = exclusions([profile_id])[profile_id]
+                    match_time, _ = timed(match, model, candidates, ACCESSES_PER_USER, profile_id=profile_id, exclude=exclude)
+                    match_timings.append(match_time)
+
+                # every user due for refresh shares the one trained model
+                for profile_id in refresh_ids:
+                    os.symlink(model_path, os.path.join(ml_dir, f"user{profile_id}.h5"))
+                accesses_before = Access.objects.count()
+                refresh_time, _ = timed(call_command, 'refresh', workers=1, stdout=io.StringIO())
+                rows['refresh_accesses'] = Access.objects.count() - accesses_before
+
+        return {
+            "population": size,
+            "create_model": percentiles(create_timings),
+            "train_model": percentiles(train_timings),
+            "load_candidates_s": round(load_time, 3),
+            "match_user": percentiles(match_timings),
+            "refresh": {
+                "users": len(refresh_ids),
+                "seconds": round(refresh_time, 3),
+                "users_per_s": round(len(refresh_ids) / refresh_time, 2),
+            },
+            "rows_written": rows,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    def bench_auth(self, size, queries, rng):
+        # brute-force style traffic: mostly unknown identifiers, some known ones with wrong passwords
+        factory = RequestFactory()
+
+        def call(view, data):
+            request = factory.post('/', content_type='application/json')
+            request.data = data
+            with CaptureQueriesContext(connection) as captured:
+                elapsed, _ = timed(view, request)
+            return elapsed, len(captured)
+
+        with synthetic_population(size, rng) as (profile_ids, _, rows):
+            sample = rng.choice(profile_ids, min(queries, size), replace=False).tolist()
+            known = list(User.objects.filter(profile__pk__in=sample).values_list('email', flat=True))
+
+            paths = {
+                'login_unknown': [(views.login, {'username': f"nobody{i}", 'password': 'wrong'}) for i in range(queries)],
+                'login_known': [(views.login, {'username': email, 'password': 'wrong'}) for email in known],
+                'otp_unknown': [(views.otp_send, {'username': f"nobody{i}", 'email': f"nobody{i}@bench.local", 'phone': str(i)}) for i in range(queries)],
+            }
+
+            results = {"population": size, "rows_written": rows}
+            for name, calls in paths.items():
+                timings, counts = zip(*(call(view, data) for view, data in calls))
+                results[name] = {**percentiles(timings), "queries_per_call": round(float(np.mean(counts)), 2)}
+        return results
+
+    def bench_firebase(self, size, queries, rng):
+        # same endpoints against the local firebase stand-in, once per injected latency
+        factory = RequestFactory()
+
+        with synthetic_population(size, rng) as (profile_ids, _, rows):
+            results = {"population": size, "rows_written": rows, "latencies": []}
+            for latency in FIREBASE_LATENCIES:
+                with override_settings(FIREBASE_BACKEND='local', FIREBASE_LATENCY=latency):
+                    backend = firebase.get_backend()
+                    pairs = rng.choice(profile_ids, (min(queries, size // 2), 2), replace=False).tolist()
+
+                    connect_timings, connects = [], []
+                    for user1_id, user2_id in pairs:
+                        connect_time, connect = timed(Connect.objects.create, user1_id=user1_id, user2_id=user2_id)
+                        connect_timings.append(connect_time)
+                        connects.append(connect)
+                        for n in range(MESSAGES_PER_CHAT):
+                            backend.add_message(connect.chat_id, n % 2 + 1, f"bench {n}")
+
+                    found_timings = []
+                    for profile in Profile.objects.filter(pk__in=[user1_id for user1_id, _ in pairs]):
+                        request = factory.get('/')
+                        request.profile = profile
+                        found_time, _ = timed(views.found, request)
+                        found_timings.append(found_time)
+
+                    firebase.unread_cache.clear()
+                    summaries_time, _ = timed(firebase.get_chat_summaries, [(connect.chat_id, 1, connect.last_read_time1) for connect in connects])
+
+                    pending = list(Notification.objects.filter(status=Notification.PENDING).select_related('profile__user'))
+                    drain_time, report = timed(deliver, pending)
+
+                    results["latencies"].append({
+                        "latency_ms": latency * 1000,
+                        "create_connect": percentiles(connect_timings),
+                        "found": percentiles(found_timings),
+                        "chat_summaries": {"chats": len(connects), "seconds": round(summaries_time, 3)},
+                        "notifications": {**report, "seconds": round(drain_time, 3)},
+                    })
+        return results
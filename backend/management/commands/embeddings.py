@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.models import Profile, Access
+from backend.matching import Candidates
+from backend.embeddings import EPOCHS, BASE_MODEL_PATH, EMBEDDINGS_PATH, EmbeddingTable, train_shared
+
+
+class Command(BaseCommand):
+
+    help = "Trains the shared match network and the per-user embedding table from viewed Access entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--epochs', help='number of training epochs', type=int, default=EPOCHS)
+        parser.add_argument('--compact', help='only drop embeddings of deleted profiles, without training', action='store_true')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['compact']:
+            table = EmbeddingTable.load(EMBEDDINGS_PATH)
+            before = len(table)
+            table.keep(Profile.objects.values_list('pk', flat=True))
+            table.save(EMBEDDINGS_PATH)
+            self.stdout.write(self.style.SUCCESS(f"Removed {before - len(table)} embeddings of deleted profiles"))
+            return
+
+        candidates = Candidates.load()
+
+        me_ids, other_ids, labels = [], [], []
+        for me_id, other_id, requested in Access.objects.filter(viewed=True).values_list('me_id', 'other_id', 'requested'):
+            if me_id in candidates.rows and other_id in candidates.rows:
+                me_ids.append(me_id)
+                other_ids.append(other_id)
+                labels.append(requested)
+
+        if not labels:
+            raise CommandError("No viewed Access entries to train on.")
+
+        self.stdout.write(f"Training on {len(labels)} entries from {len(set(me_ids))} users")
+        base, table = train_shared(candidates, me_ids, other_ids, labels, epochs=kwargs['epochs'])
+        base.save(BASE_MODEL_PATH)
+        table.save(EMBEDDINGS_PATH)
+        self.stdout.write(self.style.SUCCESS(f"Saved shared model with {len(table)} user embeddings"))
@@ -0,0 +1,39 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from backend.models import Profile
+from backend.matching import Candidates
+from backend.inference import PARITY_TOLERANCE, NumpyModel, model_path, export_model, parity
+
+PARITY_SAMPLE = 1000
+
+
+class Command(BaseCommand):
+
+    help = "Exports trained user models to quantized numpy weights and checks them against keras"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', help='id of the profile to export model for, all if not given', type=int)
+        parser.add_argument('--full', help='keep float32 weights instead of quantizing', action='store_true')
+
+    def handle(self, *args, **kwargs):
+        from algo.match import create_model
+
+        ids = [kwargs['id']] if kwargs['id'] else Profile.objects.values_list('pk', flat=True)
+        features = Candidates.load().features[:PARITY_SAMPLE]
+
+        for id in ids:
+            if not os.path.exists(path := model_path(id)):
+                continue
+
+            model = create_model(path)
+            numpy_path = model_path(id, 'npz')
+            export_model(model, numpy_path, quantized=not kwargs['full'])
+
+            error = parity(model, NumpyModel.load(numpy_path), features)
+            if error > PARITY_TOLERANCE:
+                os.remove(numpy_path)
+                self.stdout.write(self.style.ERROR(f"Model for user: {id} differs by {error:.4f}. Not exported"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Exported model for user: {id} (max difference {error:.4f})"))
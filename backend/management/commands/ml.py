@@ -1,10 +1,10 @@
-import os
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
-from algo.match import create_model, train_model, match_user
-
 from backend.models import Profile, Access
+from backend.matching import Candidates, match, exclusions
+from backend import embeddings, inference
 
 NUM_USERS_ACCESS = 5
 
@@ -24,26 +24,32 @@ class Command(BaseCommand):
         except Profile.DoesNotExist:
             raise CommandError(f"Profile with id {kwargs['id']} does not exist. Are you sure it's profile id and not user id?")
 
-        model_path = os.path.join(settings.ML_DIR, f"user{profile.id}.h5")
+        model_path = inference.model_path(profile.id)
+
+        if settings.ML_MODE == 'shared':
+            try:
+                model = embeddings.load_model(profile.id)
+            except OSError:
+                raise CommandError("Shared model does not exist. Run the embeddings command first!!")
+
+            users_to_match = kwargs['users'] or NUM_USERS_ACCESS
+        elif kwargs['train']:
+            # tensorflow is only loaded when a keras model is trained or used, inference.load_model imports it for the latter
+            from algo.match import create_model, train_model
 
-        if kwargs['train']:
             model = create_model()
             train_model(model, filepath=model_path)
             users_to_match = NUM_USERS_ACCESS
+            if settings.ML_INFERENCE == 'numpy':
+                call_command('export_models', id=profile.id, stdout=self.stdout)
         else:
             try:
-                model = create_model(model_path)
+                model = inference.load_model(profile.id)
             except OSError:
                 raise CommandError(f"Model for id {kwargs['id']} does not exist. You have to train first!!")
 
-            try:
-                users_to_match = kwargs['users']
-            except KeyError:
-                self.stdout.write(self.style.WARNING(f"Number of users not provided. Defaulting to {NUM_USERS_ACCESS}"))
-                users_to_match = NUM_USERS_ACCESS
-
-        results = match_user(model, profile, Profile.objects.all(), users_to_match=users_to_match)
-        matched_users = results.take(0, axis=1)
-        for other in matched_users:
-            access = Access.objects.create(me=profile, other=other)
+            users_to_match = kwargs['users'] or NUM_USERS_ACCESS
+
+        for other_id in match(model, Candidates.load(), users_to_match, profile_id=profile.id, exclude=exclusions([profile.id])[profile.id]):
+            access = Access.objects.create(me=profile, other_id=other_id)
             access.save()
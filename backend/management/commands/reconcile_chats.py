@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Connect
+from backend import firebase
+
+BATCH_SIZE = 100
+BATCH_DEADLINE = 120 # in seconds, offline so it can wait far longer than a request
+MISSING = object()
+
+
+class Command(BaseCommand):
+
+    help = "Reconciles the local chat summaries and unread counters shown on /found/ with Firestore"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deadline', help='seconds to wait for each batch of firestore calls', type=float, default=BATCH_DEADLINE)
+
+    def handle(self, *args, **kwargs):
+        connects = list(Connect.objects.filter(active=True).exclude(chat_id=''))
+        max_length = Connect._meta.get_field('last_message').max_length
+        updated = skipped = 0
+        for start in range(0, len(connects), BATCH_SIZE):
+            batch = connects[start:start + BATCH_SIZE]
+            results = firebase.fan_out([call for connect in batch for call in [
+                (firebase.get_last_message, connect.chat_id),
+                (firebase.get_unread_num, connect.chat_id, 1, connect.last_read_time1),
+                (firebase.get_unread_num, connect.chat_id, 2, connect.last_read_time2),
+            ]], kwargs['deadline'], missing=MISSING)
+
+            for index, connect in enumerate(batch):
+                message, unread1, unread2 = results[3 * index:3 * index + 3]
+                skipped += MISSING in (message, unread1, unread2)
+                fields = {}
+                if message is not MISSING and message is not None:
+                    fields.update(last_message_id=message.get('id', ''), last_message=str(message.get('message', ''))[:max_length], last_message_user=message.get('user'), last_message_time=message.get('timestamp'))
+                if unread1 is not MISSING:
+                    fields['unread1'] = unread1
+                if unread2 is not MISSING:
+                    fields['unread2'] = unread2
+                if fields:
+                    updated += Connect.objects.filter(pk=connect.pk).update(**fields)
+
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {updated} of {len(connects)} connects"))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"{skipped} connects were skipped or only partly reconciled, firestore calls failed or timed out"))
@@ -1,27 +1,105 @@
+import os
+import time
 import datetime
+import multiprocessing
+from collections import Counter
 
 from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connections
 from django.utils import timezone
-from django.core.management import call_command
 
-from backend.models import Access
+from backend.models import Profile, Access
+from backend.matching import Candidates, match, ensure_index, exclusions
+from backend import embeddings, inference, notifications
+from backend.management.commands.ml import NUM_USERS_ACCESS
 
 TIME_TO_REFRESH = datetime.timedelta(days=1, hours=0, minutes=0, seconds=0)
+BATCH_SIZE = 32
+
+worker = {}
+
+
+def init_worker(candidates):
+    worker['candidates'] = candidates
+    if settings.ML_MODE == 'shared':
+        worker['base'] = embeddings.load_base_model()
+        worker['table'] = embeddings.EmbeddingTable.load()
+
+def get_model(profile_id):
+    if settings.ML_MODE == 'shared':
+        return embeddings.SharedModel(worker['base'], worker['table'].get(profile_id))
+    return inference.load_model(profile_id)
+
+def match_batch(batch):
+    results = []
+    for me_id, users_to_match, exclude in batch:
+        try:
+            model = get_model(me_id)
+        except OSError:
+            results.append((me_id, None))
+            continue
+        results.append((me_id, match(model, worker['candidates'], users_to_match, profile_id=me_id, exclude=exclude)))
+    return results
 
 
 class Command(BaseCommand):
 
     help = "Creates and updates Access entries for users whose Access have expired"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', help='number of worker processes to match with', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', help='number of users per worker task', type=int, default=BATCH_SIZE)
+
     def handle(self, *args, **kwargs):
+        start = time.perf_counter()
+
         expire_time = timezone.localtime() - TIME_TO_REFRESH
         objects = Access.objects.filter(active=True).filter(create_time__lt=expire_time)
+        count_users = Counter(objects.values_list('me_id', flat=True))
 
-        self.stdout.write(f"Expiring {len(objects)} old entries")
+        self.stdout.write(f"Expiring {sum(count_users.values())} old entries")
         objects.update(active=False)
 
-        if users := [access.me for access in objects]:
-            count_users = {user: users.count(user) for user in users}
-            for me in count_users:
-                self.stdout.write(f"Creating {count_users[me]} new entries for user: {me.id} - {me}")
-                call_command("ml", id=me.id, train=False, users=count_users[me])
+        if settings.ML_MODE == 'shared':
+            # new users get no training job in shared mode, their first accesses are matched here
+            new_users = Profile.objects.filter(me=None).values_list('pk', flat=True)
+            count_users.update({profile_id: NUM_USERS_ACCESS for profile_id in new_users})
+
+        if not count_users:
+            return
+
+        candidates = Candidates.load()
+        ensure_index(candidates)
+        excluded = exclusions(count_users)
+        users = [(me_id, count, excluded[me_id]) for me_id, count in count_users.items()]
+        batches = [users[i:i + kwargs['batch_size']] for i in range(0, len(users), kwargs['batch_size'])]
+
+        matched = 0
+        if kwargs['workers'] > 1 and len(batches) > 1:
+            # forked workers must not inherit open db connections
+            connections.close_all()
+            with multiprocessing.Pool(min(kwargs['workers'], len(batches)), initializer=init_worker, initargs=(candidates, )) as pool:
+                for results in pool.imap_unordered(match_batch, batches):
+                    matched += self.create_accesses(results)
+        else:
+            init_worker(candidates)
+            for batch in batches:
+                matched += self.create_accesses(match_batch(batch))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Matched {matched} users in {elapsed:.2f}s ({matched / elapsed:.1f} users/sec)"))
+
+    def create_accesses(self, results):
+        accesses = []
+        for me_id, other_ids in results:
+            if other_ids is None:
+                self.stdout.write(self.style.ERROR(f"Model for user: {me_id} does not exist. Skipping"))
+                continue
+            self.stdout.write(f"Creating {len(other_ids)} new entries for user: {me_id}")
+            accesses += [Access(me_id=me_id, other_id=other_id) for other_id in other_ids]
+
+        Access.objects.bulk_create(accesses)
+        # bulk_create skips signals, the new access notifications on_access_save would queue are queued here
+        notifications.queue_many([access.me_id for access in accesses], notifications.NEW_ACCESS, type='Find')
+        return sum(other_ids is not None for _, other_ids in results)
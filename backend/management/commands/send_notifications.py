@@ -0,0 +1,53 @@
+import time
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend.models import Notification
+from backend.notifications import MAX_ATTEMPTS, deliver
+from backend.queues import requeue_stale
+
+BATCH_SIZE = 500
+POLL_INTERVAL = 1 # in seconds
+CLAIM_TIMEOUT = datetime.timedelta(minutes=5)
+RETENTION = datetime.timedelta(days=7)
+PRUNE_INTERVAL = 60 * 60 # in seconds
+
+
+def claim(batch_size):
+    now = timezone.now()
+    ids = list(Notification.objects.filter(status=Notification.PENDING, next_attempt_time__lte=now).order_by('next_attempt_time').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    Notification.objects.filter(pk__in=ids, status=Notification.PENDING).update(status=Notification.SENDING, claim_time=now)
+    return list(Notification.objects.filter(pk__in=ids, status=Notification.SENDING, claim_time=now).select_related('profile__user'))
+
+
+class Command(BaseCommand):
+
+    help = "Delivers queued notifications through fcm in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', help='notifications per fcm batch', type=int, default=BATCH_SIZE)
+        parser.add_argument('--once', help='exit once the queue is empty', action='store_true')
+
+    def handle(self, *args, **kwargs):
+        last_prune = 0
+        while True:
+            requeued, failed = requeue_stale(Notification, Notification.SENDING, 'claim_time', CLAIM_TIMEOUT, MAX_ATTEMPTS)
+            if requeued or failed:
+                self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale notifications, {failed} failed"))
+
+            if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                Notification.objects.filter(status=Notification.SENT, send_time__lt=timezone.now() - RETENTION).delete()
+                last_prune = time.monotonic()
+
+            notifications = claim(kwargs['batch_size'])
+            if notifications:
+                report = deliver(notifications)
+                self.stdout.write(f"Sent {report['sent']} of {len(notifications)} notifications, {report['retried']} to retry, {report['failed']} failed, {report['invalid_tokens']} invalid tokens cleared")
+            elif kwargs['once']:
+                break
+            else:
+                time.sleep(POLL_INTERVAL)
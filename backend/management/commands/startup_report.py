@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+HEAVY_PACKAGES = ['tensorflow', 'firebase_admin', 'googleapiclient', 'google', 'numpy', 'PIL']
+TARGETS = {
+    # what a web worker imports before serving its first request
+    'wsgi': "import server.wsgi, server.urls",
+    'manage': "import sys; sys.argv = ['manage.py', 'check']; import manage; manage.main()",
+}
+
+
+class Command(BaseCommand):
+
+    help = "Reports import time per top level package for a cold web worker or manage.py start"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', help='startup to measure', choices=TARGETS, default='wsgi')
+        parser.add_argument('--top', help='number of packages to list', type=int, default=15)
+
+    def handle(self, *args, **kwargs):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'server.settings')}
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', TARGETS[kwargs['target']]], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(result.stderr.splitlines()[-1] if result.stderr else 'Startup failed.')
+
+        # lines look like `import time:       self [us] |  cumulative | imported package`
+        packages = defaultdict(int)
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_time, _, name = line[len('import time:'):].split('|')
+            packages[name.strip().split('.')[0]] += int(self_time)
+            total += int(self_time)
+
+        self.stdout.write(f"Total import time: {total / 1000:.1f} ms")
+        for package, time in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:kwargs['top']]:
+            line = f"{package:<30} {time / 1000:>9.1f} ms {100 * time / total:>5.1f}%"
+            self.stdout.write(self.style.WARNING(line) if package in HEAVY_PACKAGES else line)
+
+        if loaded := [package for package in HEAVY_PACKAGES[:3] if package in packages]:
+            self.stdout.write(self.style.ERROR(f"Heavy packages loaded at startup: {', '.join(loaded)}"))
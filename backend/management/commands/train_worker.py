@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import datetime
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from backend.models import TrainingJob
+from backend.queues import requeue_stale
+
+CONCURRENCY = 2
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5 # in seconds
+JOB_TIMEOUT = datetime.timedelta(minutes=30)
+
+
+def claim(job_id):
+    return TrainingJob.objects.filter(pk=job_id, status=TrainingJob.PENDING).update(status=TrainingJob.RUNNING, start_time=timezone.now())
+
+def run_job(job_id, profile_id, attempts):
+    try:
+        # every training runs in its own interpreter, so tensorflow memory goes away with it
+        result = subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'ml', '--id', str(profile_id), '--train'],
+            capture_output=True, text=True, timeout=JOB_TIMEOUT.total_seconds(),
+        )
+        error = result.stderr[-2000:] if result.returncode else ''
+    except subprocess.TimeoutExpired:
+        error = 'Training timed out.'
+
+    if not error:
+        status = TrainingJob.DONE
+    elif attempts + 1 < MAX_ATTEMPTS:
+        status = TrainingJob.PENDING
+    else:
+        status = TrainingJob.FAILED
+
+    TrainingJob.objects.filter(pk=job_id).update(status=status, attempts=attempts + 1, error=error, finish_time=timezone.now())
+    connection.close()
+    return status
+
+
+class Command(BaseCommand):
+
+    help = "Runs queued model training jobs with a fixed concurrency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', help='number of trainings to run at once', type=int, default=CONCURRENCY)
+        parser.add_argument('--once', help='exit once the queue is empty', action='store_true')
+
+    def handle(self, *args, **kwargs):
+        concurrency = kwargs['concurrency']
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            running = set()
+            while True:
+                requeued, failed = requeue_stale(TrainingJob, TrainingJob.RUNNING, 'start_time', JOB_TIMEOUT, MAX_ATTEMPTS)
+                if requeued or failed:
+                    self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale jobs, {failed} failed"))
+
+                running = {future for future in running if not future.done()}
+                jobs = TrainingJob.objects.filter(status=TrainingJob.PENDING).order_by('create_time')
+                for job in jobs[:concurrency - len(running)]:
+                    if claim(job.id):
+                        self.stdout.write(f"Training model for user: {job.profile_id} (attempt {job.attempts + 1})")
+                        running.add(executor.submit(run_job, job.id, job.profile_id, job.attempts))
+
+                if kwargs['once'] and not running and not jobs.exists():
+                    break
+                time.sleep(POLL_INTERVAL if len(running) < concurrency else 1)
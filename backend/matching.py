@@ -0,0 +1,96 @@
+import numpy as np
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Access, Connect, Profile
+from .features import load_features
+from .ann import index
+
+from algo.parameters import NUM_FACETS
+
+PREDICT_BATCH_SIZE = 4096
+SHORTLIST_SIZE = 1000
+QUERY_CHUNK_SIZE = 500
+
+
+class Candidates:
+    # row i is `[facets | normalized interests]` of profile ids[i], same values as Profile.facets / Profile.interests
+
+    def __init__(self, ids, features):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
+        self.rows = {id: row for row, id in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def facets(self):
+        return self.features[:, :NUM_FACETS]
+
+    def subset(self, ids):
+        rows = [self.rows[id] for id in np.asarray(ids).tolist() if id in self.rows]
+        return Candidates(self.ids[rows], self.features[rows])
+
+    def exclude(self, ids):
+        if ids is None or not len(ids):
+            return self
+        keep = ~np.isin(self.ids, ids, assume_unique=True)
+        return Candidates(self.ids[keep], self.features[keep])
+
+    @classmethod
+    def load(cls):
+        return cls(*load_features())
+
+
+def exclusions(profile_ids):
+    # sorted ids each profile must never be matched with: itself, anyone it already had access to, and its connects
+    profile_ids = list(profile_ids)
+    excluded = {id: [id] for id in profile_ids}
+    for start in range(0, len(profile_ids), QUERY_CHUNK_SIZE):
+        chunk = profile_ids[start:start + QUERY_CHUNK_SIZE]
+        for me_id, other_id in Access.objects.filter(me_id__in=chunk).values_list('me_id', 'other_id'):
+            excluded[me_id].append(other_id)
+        for user1_id, user2_id in Connect.objects.filter(Q(user1_id__in=chunk) | Q(user2_id__in=chunk)).values_list('user1_id', 'user2_id'):
+            if user1_id in excluded:
+                excluded[user1_id].append(user2_id)
+            if user2_id in excluded:
+                excluded[user2_id].append(user1_id)
+    return {id: np.unique(np.asarray(ids, dtype=np.int64)) for id, ids in excluded.items()}
+
+
+def score(model, candidates):
+    if not len(candidates):
+        return np.zeros(0, dtype=np.float32)
+    return np.asarray(model.predict(candidates.features, batch_size=PREDICT_BATCH_SIZE), dtype=np.float32).reshape(-1)
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    indices = np.argpartition(-scores, k - 1)[:k]
+    return indices[np.argsort(-scores[indices], kind='stable')]
+
+def ensure_index(candidates):
+    if not index.built:
+        stored = dict(Profile.objects.exclude(lsh_keys='').values_list('pk', 'lsh_keys'))
+        index.build(candidates.ids, candidates.facets, stored)
+
+def shortlist(candidates, profile_id, size=SHORTLIST_SIZE):
+    ensure_index(candidates)
+    return candidates.subset(index.query(candidates.facets[candidates.rows[profile_id]], size))
+
+def use_shortlist(candidates, profile_id):
+    # past MATCH_EXHAUSTIVE_LIMIT only the profiles closest in personality are scored, never when it is None
+    limit = settings.MATCH_EXHAUSTIVE_LIMIT
+    return limit is not None and profile_id in candidates.rows and len(candidates) > limit
+
+def match(model, candidates, users_to_match, profile_id=None, exclude=None, shortlisted=None):
+    if shortlisted is None:
+        shortlisted = use_shortlist(candidates, profile_id)
+    if shortlisted:
+        candidates = shortlist(candidates, profile_id)
+    candidates = candidates.exclude(exclude)
+    scores = score(model, candidates)
+    return candidates.ids[top_k(scores, users_to_match)].tolist()
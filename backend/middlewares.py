@@ -1,11 +1,34 @@
 import json
-from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
+import hashlib
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse, JsonResponse
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import parse_etags
+from django.utils.functional import SimpleLazyObject
 from django.urls import reverse
 
-from .models import User
+from .models import User, Profile
+from .cache import catalog_version, tokens
 
 
+class StatelessSessionMiddleware(SessionMiddleware):
+    # bearer token endpoints get an empty in-memory session that is never loaded or saved
+
+    def is_stateless(self, request):
+        return request.path_info.startswith(tuple(settings.STATELESS_PATH_PREFIXES))
+
+    def process_request(self, request):
+        if self.is_stateless(request):
+            request.session = self.SessionStore()
+        else:
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if self.is_stateless(request):
+            return response
+        return super().process_response(request, response)
+
 class PostJsonMiddleware:
 
     def __init__(self, get_response):
@@ -21,6 +44,27 @@ class PostJsonMiddleware:
 
 class AuthTokenMiddleware(MiddlewareMixin):
 
+    def not_modified(self, request, etag):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        return etag in etags or '*' in etags
+
+    def not_modified_response(self, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    def authenticate(self, token):
+        if entry := tokens.get(token):
+            return entry
+        try:
+            entry = User.objects.filter(token=token).values_list('pk', 'profile__pk', 'expired').get()
+        except User.DoesNotExist:
+            return None
+        tokens.set(token, *entry)
+        return entry
+
     def process_view(self, request, view_func, view_args, view_kwargs):
 
         response = {'error': ''}
@@ -31,16 +75,16 @@ class AuthTokenMiddleware(MiddlewareMixin):
                 splits = request.META['HTTP_AUTHORIZATION'].split("Bearer ")
                 if len(splits) == 2 and splits[0] == "":
                     token = splits[1]
-                    try:
-                        user = User.objects.get(token=token)
-                        if user.expired:
-                            response['error'] = 'Auth token expired.'
-                            code = 401
-                        else:
-                            request.profile = user.profile
-                    except User.DoesNotExist:
+                    user_id, profile_id, expired = (token and self.authenticate(token)) or (None, None, False)
+                    if profile_id is None:
                         response['error'] = 'Invalid auth token.'
                         code = 403
+                    elif expired:
+                        response['error'] = 'Auth token expired.'
+                        code = 401
+                    else:
+                        # the profile is only fetched if the view actually uses it
+                        request.profile = SimpleLazyObject(lambda: Profile.objects.select_related('user').get(pk=profile_id))
                 else:
                     response['error'] = 'Invalid auth header.'
                     code = 400
@@ -48,15 +92,18 @@ class AuthTokenMiddleware(MiddlewareMixin):
                 response['error'] = 'Missing authorization.'
                 code = 403
 
+        etag = None
+        if code == 200 and getattr(view_func, 'catalog', False):
+            # catalog data only changes with the catalog version, no need to run the view to know its etag
+            etag = f'"catalog-{catalog_version()}"'
+            if self.not_modified(request, etag):
+                return self.not_modified_response(etag)
+
         if code == 200:
             data = view_func(request, *view_args, **view_kwargs)
             if isinstance(data, HttpResponse) or isinstance(data, StreamingHttpResponse):
                 return data
 
-            request.session.pop('_auth_user_id', None)
-            request.session.pop('_auth_user_backend', None)
-            request.session.pop('_auth_user_hash', None)
-
             if type(data) is dict and 'error' in data:
                 response['error'] = data.pop('error')
                 if 'code' in data:
@@ -65,4 +112,11 @@ class AuthTokenMiddleware(MiddlewareMixin):
             if response['error'] == '':
                 response = data
 
-        return JsonResponse(response, safe=False, status=code)
+        response = JsonResponse(response, safe=False, status=code)
+        if code == 200 and request.method in ('GET', 'HEAD'):
+            if etag is None:
+                etag = f'"{hashlib.sha1(response.content).hexdigest()}"'
+                if self.not_modified(request, etag):
+                    return self.not_modified_response(etag)
+            response['ETag'] = etag
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0035_connect_block'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('start_time', models.DateTimeField(null=True)),
+                ('finish_time', models.DateTimeField(null=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Profile')),
+            ],
+        ),
+    ]
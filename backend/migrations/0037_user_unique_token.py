@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0036_trainingjob'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, token=''), fields=('token',), name='unique_token'),
+        ),
+    ]
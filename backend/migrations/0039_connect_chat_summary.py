@@ -0,0 +1,43 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0038_user_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='connect',
+            name='last_message_id',
+            field=models.CharField(blank=True, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='connect',
+            name='last_message',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='connect',
+            name='last_message_user',
+            field=models.SmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='connect',
+            name='last_message_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='connect',
+            name='unread1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='connect',
+            name='unread2',
+            field=models.IntegerField(default=0),
+        ),
+    ]
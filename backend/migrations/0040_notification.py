@@ -0,0 +1,35 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0039_connect_chat_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification', models.TextField(blank=True)),
+                ('data', models.TextField(default='{}')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claim_time', models.DateTimeField(null=True)),
+                ('send_time', models.DateTimeField(null=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Profile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['status', 'next_attempt_time'], name='notification_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0040_notification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='lsh_keys',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
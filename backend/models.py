@@ -8,6 +8,8 @@ from django.core.validators import MaxValueValidator, MinValueValidator,  get_av
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .cache import cached_render, tokens
+
 from algo.parameters import *
 
 FLOAT_PRECISION = 4
@@ -119,6 +121,15 @@ class User(AbstractUser):
         related_query_name="backend_user",
     )
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['token'], condition=~models.Q(token=''), name='unique_token'),
+        ]
+        indexes = [
+            models.Index(fields=['email'], name='user_email_idx'),
+            models.Index(fields=['phone'], name='user_phone_idx'),
+        ]
+
     def new_token(self):
         import secrets
 
@@ -129,6 +140,7 @@ class User(AbstractUser):
             except User.DoesNotExist:
                 break
 
+        tokens.invalidate(self.token)
         self.token = token
         self.expired = False
         self.save()
@@ -149,13 +161,17 @@ class Profile(models.Model):
     onboarded = models.BooleanField(default=False)
     _personality = models.CharField(max_length=NUM_FACETS * FLOAT_PRECISION, default='0' * NUM_FACETS * FLOAT_PRECISION)
     last_questionnaire_time = models.DateTimeField(null=True)
+    # lsh bucket keys of the facets, recomputed on save. rows written with bulk_create are hashed when the index is built
+    lsh_keys = models.CharField(max_length=64, blank=True)
 
     def __str__(self):
         return str(self.user)
 
     def personality_representation(self, personality, indices):
-        elements = Personality.objects.order_by('trait')
-        return {elements[int(index)].display_name: personality[int(index)] for index in indices}
+        from .lookups import trait_table
+
+        names = trait_table.get()['names']
+        return {names[int(index)]: personality[int(index)] for index in indices}
 
     @property
     def facets(self):
@@ -182,11 +198,13 @@ class Profile(models.Model):
         return self
 
     def get_all_interests(self, questions=True, blank=True):
-        def get_answer(user_interest, question):
-            try:
-                return Answer.objects.get(user_interest=user_interest, question=question).text
-            except Answer.DoesNotExist:
-                return ''
+        user_interests = list(UserInterest.objects.filter(user=self).select_related('interest'))
+
+        if questions:
+            interest_questions = {user_interest.interest_id: [] for user_interest in user_interests}
+            for question in Question.objects.filter(interest__in=interest_questions.keys()):
+                interest_questions[question.interest_id].append(question)
+            answers = {(answer.user_interest_id, answer.question_id): answer.text for answer in Answer.objects.filter(user_interest__in=user_interests)}
 
         return [{
             **{
@@ -197,10 +215,10 @@ class Profile(models.Model):
             },
             **({
                 "questions": sorted(filter(lambda question: blank or question['answer'] != '', [
-                    {"id": question.id, "question": question.text, "answer": get_answer(user_interest, question)} for question in Question.objects.filter(interest=user_interest.interest)
+                    {"id": question.id, "question": question.text, "answer": answers.get((user_interest.id, question.id), '')} for question in interest_questions[user_interest.interest_id]
                 ]), key=lambda question : len(question['answer']), reverse=True)
             } if questions else {})
-        } for user_interest in UserInterest.objects.filter(user=self)]
+        } for user_interest in user_interests]
 
     def get_interest(self, pk):
         try:
@@ -208,12 +226,21 @@ class Profile(models.Model):
             return {
                 "name": user_interest.interest.name,
                 "amount": user_interest.amount,
-                "answers": [{"question": answer.question.text, "answer": answer.text} for answer in Answer.objects.filter(user_interest=user_interest)]
+                "answers": [{"question": answer.question.text, "answer": answer.text} for answer in Answer.objects.filter(user_interest=user_interest).select_related('question')]
             }
         except UserInterest.DoesNotExist:
             return {'error': 'Interest not found.', 'code': 404}
 
     def get_info(self, interest_questions=True, empty_questions=False):
+        return cached_render(self, 'info', self.render_info, interest_questions, empty_questions)
+
+    def get_basic_info(self):
+        return cached_render(self, 'basic', self.render_basic_info)
+
+    def get_partial_info(self):
+        return cached_render(self, 'partial', self.render_partial_info)
+
+    def render_info(self, interest_questions=True, empty_questions=False):
         return {
             "nick": self.user.username,
             "base_avatar": self.avatar.base.name if self.avatar else None,
@@ -224,14 +251,14 @@ class Profile(models.Model):
             "avatar_timeline": self.avatar_timeline if self.avatar else None,
         }
 
-    def get_basic_info(self):
+    def render_basic_info(self):
         return {
             "nick": self.user.username,
             "avatar": self.avatar.url if self.avatar else None,
             "mood": self.avatar.mood.name if self.avatar else None,
         }
 
-    def get_partial_info(self):
+    def render_partial_info(self):
         return {
             "avatar": self.avatar.url if self.avatar else None,
             "personality": self.major_personality,
@@ -250,9 +277,11 @@ class Profile(models.Model):
 
     @property
     def traits(self):
-        import random
+        from .lookups import trait_table
 
         facets = self.facets
+        personality = self.get_personality()
+        table = trait_table.get()
         traits = {}
 
         def find_index(element, array):
@@ -262,23 +291,18 @@ class Profile(models.Model):
             return len(array)
 
         for i in range(NUM_TRAITS):
-            personality = self.personality
-            trait = Personality.objects.get(trait=i)
-            adjs = Adjective.objects.filter(trait=i)
+            trait = table['traits'][i]
             adjectives = list()
             pool = FACET_POOLS[Trait(i)]
-            trait_value = 0
             for j in range(FACETS_PER_TRAIT):
                 facet_value = facets[i * FACETS_PER_TRAIT + j]
-                trait_value += facet_value
                 index = find_index(facet_value, pool[j + 1])
-                facet_adjs = adjs.filter(facet=j+1).filter(pool=index+1)
-                adjectives.append(facet_adjs)
-            traits[trait.display_name] = {
-                "value": personality[trait.display_name],
-                "description": trait.description,
-                "url": trait.get_urls(),
-                "adjectives": [[{"name": adjective.name, "description": adjective.description} for adjective in trait_adjs] for trait_adjs in adjectives]
+                adjectives.append(table['adjectives'].get((i, j + 1, index + 1), []))
+            traits[trait['display_name']] = {
+                "value": personality[trait['position']],
+                "description": trait['description'],
+                "url": list(trait['url']),
+                "adjectives": [[dict(adjective) for adjective in trait_adjs] for trait_adjs in adjectives]
             }
         return traits
 
@@ -413,9 +437,82 @@ class Connect(models.Model):
     retain2_time = models.DateTimeField(null=True)
     retain_time = models.DateTimeField(null=True)
 
+    last_message_id = models.CharField(max_length=30, blank=True)
+    last_message = models.CharField(max_length=200, blank=True)
+    last_message_user = models.SmallIntegerField(null=True)
+    last_message_time = models.DateTimeField(null=True)
+    unread1 = models.IntegerField(default=0)
+    unread2 = models.IntegerField(default=0)
+
     def __str__(self):
         return str(self.user1.user) + " - " + str(self.user2.user)
 
+    def get_last_message(self):
+        if self.last_message_time is None:
+            return None
+        return {"id": self.last_message_id, "user": self.last_message_user, "message": self.last_message, "timestamp": self.last_message_time}
+
+    def get_unread_num(self, me):
+        return self.unread1 if me == 1 else self.unread2
+
     def retained(self):
         return self.retained1 and self.retained2
     retained.boolean = True
+
+class TrainingJob(models.Model):
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    StatusChoices = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=StatusChoices, default=PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    create_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(null=True)
+    finish_time = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{str(self.profile)} : {self.status}"
+
+class Notification(models.Model):
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    StatusChoices = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    notification = models.TextField(blank=True)
+    data = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=StatusChoices, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    create_time = models.DateTimeField(auto_now_add=True)
+    next_attempt_time = models.DateTimeField(default=timezone.now)
+    claim_time = models.DateTimeField(null=True)
+    send_time = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_time'], name='notification_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{str(self.profile)} : {self.status}"
@@ -0,0 +1,77 @@
+import json
+import datetime
+from django.utils import timezone
+from django.db.models import Q
+
+from .models import User, Connect, Notification
+from . import firebase
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = datetime.timedelta(seconds=30)
+NEW_ACCESS = {'title': 'New accesss!', 'body': 'You have got access to a new user profile!'}
+
+
+def encode(values):
+    # fcm only takes strings
+    return json.dumps({key: str(value) for key, value in values.items()}) if values else ''
+
+def queue(profile, notification_dict, **data):
+    # written in the caller's transaction, the send_notifications worker delivers it once committed
+    return Notification.objects.create(profile=profile, notification=encode(notification_dict), data=encode(data) or '{}')
+
+def queue_many(profile_ids, notification_dict, **data):
+    # same notification to many profiles in one insert
+    notification, data = encode(notification_dict), encode(data) or '{}'
+    return Notification.objects.bulk_create([Notification(profile_id=profile_id, notification=notification, data=data) for profile_id in profile_ids])
+
+def broadcast(profile, notification_dict, **data):
+    # to the other side of every active connect in one query and one insert, each with its connect id
+    connects = Connect.objects.filter(Q(user1=profile) | Q(user2=profile), active=True).values_list('id', 'user1_id', 'user2_id')
+    notification = encode(notification_dict)
+    return Notification.objects.bulk_create([
+        Notification(profile_id=user2_id if user1_id == profile.id else user1_id, notification=notification, data=encode({**data, 'id': id}))
+        for id, user1_id, user2_id in connects
+    ])
+
+def deliver(notifications):
+    # notifications need profile__user selected
+    now = timezone.now()
+    sendable = []
+    for notification in notifications:
+        if notification.profile.user.fcm_token:
+            sendable.append(notification)
+        else:
+            notification.status, notification.error = Notification.FAILED, 'No fcm token.'
+
+    messages = [firebase.build_message(notification.profile.user.fcm_token, json.loads(notification.notification or 'null'), json.loads(notification.data)) for notification in sendable]
+    try:
+        results = firebase.send_messages(messages) if messages else []
+    except Exception as e:
+        results = [(str(e), firebase.RETRY)] * len(sendable)
+
+    report = {'sent': 0, 'retried': 0, 'failed': len(notifications) - len(sendable), 'invalid_tokens': set()}
+    for notification, result in zip(sendable, results):
+        notification.attempts += 1
+        if result is None:
+            notification.status, notification.error, notification.send_time = Notification.SENT, '', now
+            report['sent'] += 1
+            continue
+
+        error, kind = result
+        notification.error = error[-2000:]
+        if kind == firebase.TOKEN:
+            report['invalid_tokens'].add(notification.profile.user.fcm_token)
+        if kind != firebase.RETRY or notification.attempts >= MAX_ATTEMPTS:
+            notification.status = Notification.FAILED
+            report['failed'] += 1
+        else:
+            report['retried'] += 1
+            # exponential backoff, 30s, 1m, 2m, ...
+            notification.status = Notification.PENDING
+            notification.next_attempt_time = now + RETRY_DELAY * 2 ** (notification.attempts - 1)
+
+    Notification.objects.bulk_update(notifications, ['status', 'attempts', 'error', 'next_attempt_time', 'send_time'])
+    if report['invalid_tokens']:
+        User.objects.filter(fcm_token__in=report['invalid_tokens']).update(fcm_token='')
+    report['invalid_tokens'] = len(report['invalid_tokens'])
+    return report
@@ -0,0 +1,10 @@
+from django.db.models import F
+from django.utils import timezone
+
+
+def requeue_stale(model, claimed, claim_field, timeout, max_attempts):
+    # a claim that outlived its timeout most likely killed its worker, so it still counts as an attempt
+    stale = model.objects.filter(status=claimed, **{f'{claim_field}__lt': timezone.now() - timeout})
+    failed = stale.filter(attempts__gte=max_attempts - 1).update(status=model.FAILED, attempts=F('attempts') + 1, error='Timed out.')
+    requeued = stale.update(status=model.PENDING, attempts=F('attempts') + 1)
+    return requeued, failed
@@ -1,24 +1,46 @@
 import os
-import threading
+import contextlib
 from django.utils import timezone
 from django.conf import settings
-from django.core.management import call_command
 
-from .models import Profile, Connect
-from . import firebase
+from .models import Profile, Connect, TrainingJob, UserInterest
+from .cache import bump_profile
+from .features import decode_facets
+from .ann import index
+from . import firebase, notifications
 
 
 def create_user_profile(sender, instance, created, **kwargs):
     if created and not instance.is_staff:
         profile = Profile.objects.create(user=instance)
         instance.new_token()
-
-        t = threading.Thread(target=call_command, args=("ml", ), kwargs={"id": profile.id, "train": True})
-        t.setDaemon(True)
-        t.start()
+        # shared mode has no per-user model, new users use the average embedding until the embeddings command runs
+        if settings.ML_MODE != 'shared':
+            TrainingJob.objects.create(profile=profile)
 
 def delete_model(sender, instance, **kwargs):
-    os.remove(os.path.join(settings.ML_DIR, f"user{instance.id}.h5"))
+    # in shared mode the embedding of a deleted profile stays until `embeddings --compact` or the next training
+    if settings.ML_MODE != 'shared':
+        # profiles whose training job is still pending or failed have no model files
+        for extension in ['h5', 'npz']:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(settings.ML_DIR, f"user{instance.id}.{extension}"))
+
+def bump_user_render(sender, instance, **kwargs):
+    for profile_id in Profile.objects.filter(user=instance).values_list('pk', flat=True):
+        bump_profile(profile_id)
+
+def bump_profile_render(sender, instance, **kwargs):
+    bump_profile(instance.id)
+
+def bump_related_render(sender, instance, **kwargs):
+    bump_profile(instance.user_id)
+
+def bump_answer_render(sender, instance, **kwargs):
+    try:
+        bump_profile(instance.user_interest.user_id)
+    except UserInterest.DoesNotExist:
+        pass
 
 def delete_zero_interest(sender, instance, created, **kwargs):
     if not instance.amount:
@@ -30,18 +52,22 @@ def on_connect_save(sender, instance, created, **kwargs):
         instance.chat_id = chat_id
         instance.save()
         firebase.create_connect_state(instance)
-        firebase.send_notification(instance.user1, {'title': 'New connect!', 'body': 'You have got a new connect!'}, type='Found')
-        firebase.send_notification(instance.user2, {'title': 'New connect!', 'body': 'You have got a new connect!'}, type='Found')
+        notifications.queue(instance.user1, {'title': 'New connect!', 'body': 'You have got a new connect!'}, type='Found')
+        notifications.queue(instance.user2, {'title': 'New connect!', 'body': 'You have got a new connect!'}, type='Found')
+
+def update_lsh_keys(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or '_personality' in update_fields:
+        instance.lsh_keys = index.encode(index.hash(decode_facets([instance._personality]))[0])
 
 def on_access_pre_save(sender, instance, **kwargs):
     if instance.requested:
         in_db = sender.objects.get(pk=instance.pk)
         if not in_db.requested:
-            firebase.send_notification(instance.other, {'title': 'New request!', 'body': 'You have got a new connect request!'}, type='Request')
+            notifications.queue(instance.other, {'title': 'New request!', 'body': 'You have got a new connect request!'}, type='Request')
 
 def on_access_save(sender, instance, created, **kwargs):
     if created:
-        firebase.send_notification(instance.me, {'title': 'New accesss!', 'body': 'You have got access to a new user profile!'}, type='Find')
+        notifications.queue(instance.me, notifications.NEW_ACCESS, type='Find')
 
 class UpdateTime:
 
@@ -82,7 +108,7 @@ class UpdateAccessTime(UpdateTime):
 
     def send_request_notification(value, sender, instance, **kwargs):
         if value:
-            firebase.send_notification(instance.other, {'title': 'New request!', 'body': 'You have got a new connection request!'}, type='Request')
+            notifications.queue(instance.other, {'title': 'New request!', 'body': 'You have got a new connection request!'}, type='Request')
 
     attrs = {'viewed': 'view_time', 'requested': 'request_time', 'connected': 'connect_time'}
     methods = {'connected': create_connect, 'requested': send_request_notification}
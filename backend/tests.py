@@ -1,3 +1,160 @@
-from django.test import TestCase
+import time
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+
+from .models import User, Profile, Interest, UserInterest, Question, Answer, AvatarBase, Mood, Avatar, Access, Personality, Adjective
+from .lookups import trait_table
+from .features import load_features
+from .matching import Candidates, ensure_index
+from .ann import index
+from . import views
+
+from algo.parameters import NUM_TRAITS, NUM_FACETS, FACET_POOLS, Trait
+
+QUESTIONS_PER_INTEREST = 3
+NUM_ACCESSES = 500
+MAX_LIST_SECONDS = 2
+
+
+class GetAllInterestsTest(TestCase):
+
+    def setUp(self):
+        self.profile = User.objects.create_user('tester', password='find.me.tester').profile
+
+    def add_interests(self, count):
+        for _ in range(count):
+            interest = Interest.objects.create(name=f"interest{Interest.objects.count()}")
+            user_interest = UserInterest.objects.create(user=self.profile, interest=interest, amount=2)
+            for i in range(QUESTIONS_PER_INTEREST):
+                question = Question.objects.create(interest=interest, text=f"question{i}")
+                if i:
+                    Answer.objects.create(user_interest=user_interest, question=question, text='a' * i)
+
+    def test_query_count_is_constant(self):
+        self.add_interests(2)
+        with self.assertNumQueries(3):
+            self.profile.get_all_interests()
+
+        self.add_interests(20)
+        with self.assertNumQueries(3):
+            interests = self.profile.get_all_interests()
+        self.assertEqual(len(interests), 22)
+
+        with self.assertNumQueries(1):
+            self.profile.get_all_interests(questions=False)
+
+    def test_answers_are_joined(self):
+        self.add_interests(1)
+
+        questions = self.profile.get_all_interests(blank=True)[0]['questions']
+        self.assertEqual([question['answer'] for question in questions], ['aa', 'a', ''])
+
+        questions = self.profile.get_all_interests(blank=False)[0]['questions']
+        self.assertEqual([question['answer'] for question in questions], ['aa', 'a'])
+
+
+class ListViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.profile = User.objects.create_user('tester', password='find.me.tester').profile
+
+        base = AvatarBase.objects.create(name='Base', image='avatars/base/base.png')
+        mood = Mood.objects.create(name='Happy', weather='moods/happy_weather.png', icon='moods/happy_icon.svg')
+        avatar = Avatar.objects.create(base=base, mood=mood, v1='avatars/base/happy/base_happy_v1.png', v2='avatars/base/happy/base_happy_v2.png')
+
+        User.objects.bulk_create([User(username=f"other{i}", password='!') for i in range(NUM_ACCESSES)])
+        users = User.objects.filter(username__startswith='other')
+        Profile.objects.bulk_create([Profile(user=user, avatar=avatar) for user in users])
+        others = Profile.objects.filter(user__username__startswith='other')
+        Access.objects.bulk_create([Access(me=self.profile, other=other) for other in others])
+        Access.objects.bulk_create([Access(me=other, other=self.profile, viewed=True, requested=bool(i % 2)) for i, other in enumerate(others)])
+
+    def get(self, view):
+        request = RequestFactory().get('/')
+        request.profile = self.profile
+        start = time.perf_counter()
+        response = view(request)
+        self.assertLess(time.perf_counter() - start, MAX_LIST_SECONDS)
+        return response
+
+    # the rows, one read of every render version from the shared cache, and for find the views-remaining count.
+    # the same cold and warm, renders themselves never query
+    def test_find(self):
+        for _ in range(2):
+            with self.assertNumQueries(3):
+                response = self.get(views.find)
+        self.assertEqual(len(response['users']), NUM_ACCESSES)
+        self.assertEqual(response['users'][0]['mood'], 'Happy')
+
+    def test_views(self):
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                response = self.get(views.views)
+        self.assertEqual(len(response), NUM_ACCESSES // 2)
+
+    def test_requests(self):
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                response = self.get(views.requests)
+        self.assertEqual(len(response), NUM_ACCESSES // 2)
+
+    def test_profile_change_is_rendered(self):
+        other = Access.objects.filter(me=self.profile).select_related('other__user').first().other
+        self.get(views.find)
+        other.user.username = 'renamed'
+        other.user.save()
+        self.assertIn('renamed', [user['nick'] for user in self.get(views.find)['users']])
+
+
+class TraitTableTest(TestCase):
+
+    def setUp(self):
+        trait_table.invalidate()
+        self.profile = User.objects.create_user('tester', password='find.me.tester').profile
+        for trait in range(NUM_TRAITS):
+            Personality.objects.create(trait=trait, display_name=f"trait{trait}", description='old')
+
+    def test_warm_lookups_need_no_queries(self):
+        self.profile.traits
+        with self.assertNumQueries(0):
+            traits = self.profile.traits
+            self.profile.personality
+            self.profile.major_personality
+        self.assertEqual(len(traits), NUM_TRAITS)
+
+    def test_personality_save_invalidates(self):
+        self.assertEqual(self.profile.traits['trait0']['description'], 'old')
+        personality = Personality.objects.get(trait=0)
+        personality.description = 'new'
+        personality.save()
+        self.assertEqual(self.profile.traits['trait0']['description'], 'new')
+
+    def test_adjective_save_invalidates(self):
+        self.assertEqual(self.profile.traits['trait0']['adjectives'][0], [])
+        # whichever pool the profile's first facet falls in
+        for pool in range(1, len(FACET_POOLS[Trait(0)][1]) + 2):
+            Adjective.objects.create(name='kind', trait=0, facet=1, pool=pool)
+        self.assertEqual(self.profile.traits['trait0']['adjectives'][0], [{'name': 'kind', 'description': ''}])
+
+
+class LSHKeysTest(TestCase):
+
+    def setUp(self):
+        self.profile = User.objects.create_user('tester', password='find.me.tester').profile
+        index.built = False
+        self.addCleanup(setattr, index, 'built', False)
+
+    def test_save_facets_rehashes(self):
+        default_keys = self.profile.lsh_keys
+        # centered facets are all zero, no hyperplane has them on its positive side
+        self.profile.save_facets([0.5] * NUM_FACETS)
+        self.assertEqual(Profile.objects.get(pk=self.profile.pk).lsh_keys, '0' * len(default_keys))
+        self.assertNotEqual(default_keys, self.profile.lsh_keys)
+
+    def test_build_reuses_stored_keys(self):
+        self.profile.save_facets([0.9] * NUM_FACETS)
+        ids, features = load_features()
+        ensure_index(Candidates(ids, features))
+        self.assertEqual(index.encode(index.keys[self.profile.pk]), self.profile.lsh_keys)
@@ -1,21 +1,24 @@
 import json
 
-from django.contrib.auth import authenticate, login as auth_login
+from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.exceptions import ValidationError
 from django.views.decorators.http import require_GET, require_POST, require_http_methods
 from django.utils import timezone
 from django.core.mail import send_mail
+from django.db.models import Q, F, Case, When, Value, BooleanField
 
-from .decorators import auth_exempt
+from .decorators import auth_exempt, catalog
 from .models import *
-from . import firebase
+from . import notifications
+from .cache import tokens, prefetched_versions
 
 from algo.parameters import *
 
 
 MAX_PROFILE_VIEWS = 0
+BASIC_INFO_RELATED = ['user', 'avatar__base', 'avatar__mood']
 MOOD_CHANGE_TIME = 60 * 60 * 4 # in seconds
 QUESTION_FACETS = {
     "Do you find it easy to meet new people and make friends?": (Trait.E, 1),
@@ -38,24 +41,25 @@ OPTION_VALUES = {
 }
 
 def get_user(request):
-    user = None
-    try:
-        user = User.objects.get(username=request.data['username'])
-    except:
-        try:
-            user = User.objects.get(email=request.data['username'])
-        except:
-            try:
-                user = User.objects.get(phone=request.data['username'])
-            except:
-                try:
-                    user = User.objects.get(email=request.data['email'])
-                except:
-                    try:
-                        user = User.objects.get(phone=request.data['phone'])
-                    except:
-                        user = None
-    return user
+    data = request.data if isinstance(request.data, dict) else {}
+    # same precedence as looking each one up in turn, a lookup matching several users is skipped
+    lookups = [(field, data.get(key)) for field, key in [('username', 'username'), ('email', 'username'), ('phone', 'username'), ('email', 'email'), ('phone', 'phone')]]
+    lookups = [(field, value) for field, value in lookups if value]
+    if not lookups:
+        return None
+
+    query = Q()
+    for field, value in lookups:
+        query |= Q(**{field: value})
+    # the db flags which lookups each user matched, so matching follows its collation and not python's ==
+    flags = {f"match{i}": Case(When(Q(**{field: value}), then=Value(True)), default=Value(False), output_field=BooleanField()) for i, (field, value) in enumerate(lookups)}
+    users = list(User.objects.filter(query).annotate(**flags).order_by('pk'))
+
+    for i in range(len(lookups)):
+        matches = [user for user in users if getattr(user, f"match{i}")]
+        if len(matches) == 1:
+            return matches[0]
+    return None
 
 @require_GET
 @auth_exempt
@@ -78,7 +82,7 @@ def register(request):
         user.fill_details(email=request.data.get('email'), phone=request.data.get('phone'))
         try:
             validate_password(request.data['password'], user)
-            auth_login(request, user)
+            user.last_login = timezone.now()
             user.otp = ''
             user.verified = False
             user.save()
@@ -103,7 +107,7 @@ def login(request):
     if user is not None:
         user = authenticate(username=user.username, password=request.data['password'])
         if user is not None:
-            auth_login(request, user)
+            user.last_login = timezone.now()
             user.otp = ''
             user.verified = False
             user.save()
@@ -140,7 +144,7 @@ def login_external(request):
         if id is None:
             user_ids[key] = external_id[key]
             user.external_ids = json.dumps(user_ids)
-            auth_login(request, user)
+            user.last_login = timezone.now()
             user.otp = ''
             user.verified = False
             user.save()
@@ -160,7 +164,7 @@ def login_external(request):
     except User.DoesNotExist:
         user = User.objects.create_user(email, email=email, external_ids=json.dumps(external_id))
         user.set_unusable_password()
-        auth_login(request, user)
+        user.last_login = timezone.now()
         user.otp = ''
         user.verified = False
         user.save()
@@ -184,10 +188,7 @@ def fill_details(request):
         request.profile.user.fill_details(username=request.data.get('username'), email=request.data.get('email'), phone=request.data.get('phone'))
 
         if 'username' in request.data:
-            for connect in Connect.objects.filter(active=True, user1=request.profile):
-                firebase.send_notification(connect.user2, None, type='NickUpdate', id=str(connect.id), nick=request.data['username'])
-            for connect in Connect.objects.filter(active=True, user2=request.profile):
-                firebase.send_notification(connect.user1, None, type='NickUpdate', id=str(connect.id), nick=request.data['username'])
+            notifications.broadcast(request.profile, None, type='NickUpdate', nick=request.data['username'])
 
     else:
         return {'error': 'User already exists.'}
@@ -202,6 +203,7 @@ def logout(request):
     request.profile.user.expired = True
     request.profile.user.fcm_token = ''
     request.profile.user.save()
+    tokens.invalidate(request.profile.user.token)
 
 @require_POST
 @auth_exempt
@@ -328,7 +330,7 @@ def me_personality_update(request):
                     else:
                         prev_facets[index] = value * weight + prev_facets[index] * (1 - weight)
             profile.save_facets(prev_facets)
-        firebase.send_notification(profile, {'title': 'Personality updated!', 'body': 'Your personality has been updated according to the questions you answered!'} if profile.onboarded else None, type='Personality')
+        notifications.queue(profile, {'title': 'Personality updated!', 'body': 'Your personality has been updated according to the questions you answered!'} if profile.onboarded else None, type='Personality')
 
 @require_GET
 def me_interests(request):
@@ -416,15 +418,13 @@ def me_avatar_update(request):
         request.profile.avatar = avatar
         request.profile.save()
 
-        for connect in Connect.objects.filter(active=True, user1=request.profile):
-            firebase.send_notification(connect.user2, None, type='AvatarUpdate', id=str(connect.id), base=avatar.base.name, mood=avatar.mood.name)
-        for connect in Connect.objects.filter(active=True, user2=request.profile):
-            firebase.send_notification(connect.user1, None, type='AvatarUpdate', id=str(connect.id), base=avatar.base.name, mood=avatar.mood.name)
+        notifications.broadcast(request.profile, None, type='AvatarUpdate', base=avatar.base.name, mood=avatar.mood.name)
 
     except Avatar.DoesNotExist:
         return {'error': 'Avatar not found.', 'code': 404}
 
 @require_GET
+@catalog
 def interests(request):
     return [{
         "id": interest.id,
@@ -437,6 +437,7 @@ def interests(request):
     } for interest in Interest.objects.all()]
 
 @require_GET
+@catalog
 def interest(request, pk):
     try:
         interest = Interest.objects.get(pk=pk)
@@ -445,6 +446,7 @@ def interest(request, pk):
         return {'error': 'Interest not found.', 'code': 404}
 
 @require_GET
+@catalog
 def base_avatars(request):
     return [{
         "id": base.id,
@@ -454,6 +456,7 @@ def base_avatars(request):
     } for base in AvatarBase.objects.all()]
 
 @require_GET
+@catalog
 def avatars(request, pk):
     try:
         base = AvatarBase.objects.get(pk=pk)
@@ -462,10 +465,12 @@ def avatars(request, pk):
         return {'error': 'Avatar not found.', 'code': 404}
 
 @require_GET
+@catalog
 def moods(request):
     return [{"id": mood.id, "name": mood.name, "url": mood.url} for mood in Mood.objects.all()]
 
 @require_GET
+@catalog
 def personality(request):
     all_questionnaires = PersonalityQuestionnaire.objects.all()
     initial_questionnaires = all_questionnaires.filter(initial=True)
@@ -486,8 +491,11 @@ def personality(request):
 
 @require_GET
 def find(request):
+    accesses = list(Access.objects.filter(active=True).filter(me=request.profile).filter(connected=False).select_related(*(f'other__{related}' for related in BASIC_INFO_RELATED)))
+    with prefetched_versions(access.other_id for access in accesses):
+        users = [{**access.other.get_basic_info(), **{"id": access.id, "timestamp": access.create_time}} for access in accesses]
     return {
-        "users": [{**access.other.get_basic_info(), **{"id": access.id, "timestamp": access.create_time}} for access in Access.objects.filter(active=True).filter(me=request.profile).filter(connected=False)],
+        "users": users,
         "views-remaining": MAX_PROFILE_VIEWS - Access.objects.filter(active=True).filter(me=request.profile).filter(viewed=True).count(),
     }
 
@@ -522,7 +530,9 @@ def request(request):
 
 @require_GET
 def views(request):
-    return [{**access.me.get_basic_info(), **{"id": access.id, "timestamp": access.view_time}} for access in Access.objects.filter(active=True).filter(other=request.profile).filter(viewed=True).filter(requested=False)]
+    accesses = list(Access.objects.filter(active=True).filter(other=request.profile).filter(viewed=True).filter(requested=False).select_related(*(f'me__{related}' for related in BASIC_INFO_RELATED)))
+    with prefetched_versions(access.me_id for access in accesses):
+        return [{**access.me.get_basic_info(), **{"id": access.id, "timestamp": access.view_time}} for access in accesses]
 
 @require_GET
 def view_view(request, pk):
@@ -536,7 +546,9 @@ def view_view(request, pk):
 
 @require_GET
 def requests(request):
-    return [{**access.me.get_basic_info(), **{"id": access.id, "timestamp": access.request_time}} for access in Access.objects.filter(active=True).filter(other=request.profile).filter(requested=True).filter(connected=False)]
+    accesses = list(Access.objects.filter(active=True).filter(other=request.profile).filter(requested=True).filter(connected=False).select_related(*(f'me__{related}' for related in BASIC_INFO_RELATED)))
+    with prefetched_versions(access.me_id for access in accesses):
+        return [{**access.me.get_basic_info(), **{"id": access.id, "timestamp": access.request_time}} for access in accesses]
 
 @require_GET
 def request_view(request, pk):
@@ -565,18 +577,19 @@ def accept(request):
 @require_GET
 def found(request):
     active_connects = Connect.objects.filter(active=True).filter(block=None)
-    connects = [(connect, 1) for connect in active_connects.filter(user1=request.profile)]
-    connects += [(connect, 2) for connect in active_connects.filter(user2=request.profile)]
-    return [{**(connect.user2 if me == 1 else connect.user1).get_basic_info(), **{
-        "id": connect.id,
-        "timestamp": connect.create_time,
-        "me": me,
-        "chat_id": connect.chat_id,
-        "last_message": firebase.get_last_message(connect.chat_id),
-        "unread_num": firebase.get_unread_num(connect.chat_id, me, connect.last_read_time1 if me == 1 else connect.last_read_time2),
-        "retain_request_sent": connect.retained1 if me == 1 else connect.retained2,
-        "retained": connect.retained(),
-    }} for connect, me in connects]
+    connects = [(connect, 1) for connect in active_connects.filter(user1=request.profile).select_related(*(f'user2__{related}' for related in BASIC_INFO_RELATED))]
+    connects += [(connect, 2) for connect in active_connects.filter(user2=request.profile).select_related(*(f'user1__{related}' for related in BASIC_INFO_RELATED))]
+    with prefetched_versions(connect.user2_id if me == 1 else connect.user1_id for connect, me in connects):
+        return [{**(connect.user2 if me == 1 else connect.user1).get_basic_info(), **{
+            "id": connect.id,
+            "timestamp": connect.create_time,
+            "me": me,
+            "chat_id": connect.chat_id,
+            "last_message": connect.get_last_message(),
+            "unread_num": connect.get_unread_num(me),
+            "retain_request_sent": connect.retained1 if me == 1 else connect.retained2,
+            "retained": connect.retained(),
+        }} for connect, me in connects]
 
 @require_POST
 def found_read(request):
@@ -585,11 +598,13 @@ def found_read(request):
         time = timezone.now()
         if connect.user1 == request.profile and time > connect.last_read_time1:
             connect.last_read_time1 = time
-            connect.save()
+            connect.unread1 = 0
+            connect.save(update_fields=['last_read_time1', 'unread1'])
             return
         if connect.user2 == request.profile and time > connect.last_read_time2:
             connect.last_read_time2 = time
-            connect.save()
+            connect.unread2 = 0
+            connect.save(update_fields=['last_read_time2', 'unread2'])
             return
     except Connect.DoesNotExist:
         pass
@@ -617,13 +632,13 @@ def found_retain(request):
             if connect.retained1:
                 return {'error': 'Retain request already sent.'}
             connect.retained1 = True
-            connect.save()
+            connect.save(update_fields=['retained1', 'retain1_time', 'retain_time'])
             return
         if connect.user2 == request.profile:
             if connect.retained2:
                 return {'error': 'Retain request already sent.'}
             connect.retained2 = True
-            connect.save()
+            connect.save(update_fields=['retained2', 'retain2_time', 'retain_time'])
             return
     except Connect.DoesNotExist:
         pass
@@ -635,11 +650,11 @@ def found_block(request):
         connect = Connect.objects.get(active=True, block=None, pk=request.data['id'])
         if connect.user1 == request.profile:
             connect.block = 1
-            connect.save()
+            connect.save(update_fields=['block'])
             return
         if connect.user2 == request.profile:
             connect.block = 2
-            connect.save()
+            connect.save(update_fields=['block'])
             return
     except Connect.DoesNotExist:
         pass
@@ -664,14 +679,24 @@ def notification_send(request):
 
             profile = None
             if connect.user1 == request.profile:
-                profile = connect.user2
+                profile, me = connect.user2, 1
             if connect.user2 == request.profile:
-                profile = connect.user1
+                profile, me = connect.user1, 2
 
             if profile is None:
                 return {'error': 'Connect not found.', 'code': 404}
 
-            firebase.send_notification(profile, {'title': request.profile.user.username, 'body': request.data.get('message', '')}, type='Chat', id=str(id), display='false')
+            # the /found/ summary is kept here, so listing chats never has to ask firestore
+            unread = f'unread{3 - me}'
+            Connect.objects.filter(pk=connect.pk).update(**{
+                'last_message_id': str(request.data.get('message_id', ''))[:Connect._meta.get_field('last_message_id').max_length],
+                'last_message': str(request.data.get('message', ''))[:Connect._meta.get_field('last_message').max_length],
+                'last_message_user': me,
+                'last_message_time': timezone.now(),
+                unread: F(unread) + 1,
+            })
+
+            notifications.queue(profile, {'title': request.profile.user.username, 'body': request.data.get('message', '')}, type='Chat', id=str(id), display='false')
         else:
             return {'error': 'Invalid type.', 'code': 400}
     else:
@@ -24,6 +24,11 @@ with open(os.path.join(BASE_DIR, 'django-key.txt')) as f:
     SECRET_KEY = f.read()
 GOOGLE_CREDENTIALS_PATH = os.path.join(BASE_DIR, 'credentials.json')
 FIREBASE_CREDENTIALS_PATH = os.path.join(BASE_DIR, 'firebase_credentials.json')
+FIREBASE_DATABASE_URL = 'https://findmetoo-c20a2-default-rtdb.firebaseio.com/'
+# 'firebase': firebase_admin with the credentials above, 'local': in-memory stand-in for offline runs and load tests
+FIREBASE_BACKEND = 'firebase'
+# seconds added to every call of the local backend, to see how firebase delays show up in endpoint latency
+FIREBASE_LATENCY = 0
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -48,7 +53,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'backend.middlewares.StatelessSessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -57,6 +62,9 @@ MIDDLEWARE = [
     'backend.middlewares.AuthTokenMiddleware',
 ]
 
+# sessions are only kept for the admin, api requests authenticate with bearer tokens
+STATELESS_PATH_PREFIXES = ['/api/']
+
 ROOT_URLCONF = 'server.urls'
 
 TEMPLATES = [
@@ -87,6 +95,28 @@ DATABASES = {
 }
 
 
+# Cache
+# Rendered profiles are kept per process, the versions that invalidate them have to be seen by every worker process.
+# Versions never expire and a missing one reads as never bumped, so the versions table must stay under MAX_ENTRIES.
+# The table is created with `python manage.py createcachetable`
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'backend_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -132,3 +162,11 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 ML_DIR = os.path.join(BASE_DIR, 'models')
 os.makedirs(ML_DIR, exist_ok=True)
+
+# 'user': one full model file per user, 'shared': one shared network + per-user embedding table
+ML_MODE = 'user'
+# 'keras': load .h5 models for matching, 'numpy': use exported quantized .npz weights when present
+ML_INFERENCE = 'keras'
+# candidates past which matching only scores an lsh shortlist of similar personalities, None to always score everyone.
+# only set it to a size where `python manage.py benchmark --suite shortlist` passes its recall gate for the model in use
+MATCH_EXHAUSTIVE_LIMIT = None
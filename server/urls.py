@@ -2,16 +2,30 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from django.contrib.admin.views.decorators import staff_member_required
 
 
 def docs(request):
     from django.shortcuts import render
     return render(request, 'docs.html')
 
+@staff_member_required
+def stats(request):
+    # counters are kept per process, under several workers this is only the one that served the request
+    import os
+    from django.http import JsonResponse
+    from backend import cache, firebase
+    return JsonResponse({
+        'pid': os.getpid(),
+        'render_cache': {**cache.stats, 'hit_rate': cache.hit_rate()},
+        'firebase': firebase.call_stats(),
+    })
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('backend.urls')),
     path('docs/', docs),
+    path('stats/', stats),
 ]
 
 if settings.DEBUG: